@@ -551,7 +551,7 @@ class Executor(object):
                     if timeout is None:
                         yield future.result()
                     else:
-                        yield future.result(endtime - time.time())
+                        yield future.result(end_time - time.time())
             finally:
                 for future in fs:
                     future.cancel()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""ThreadPoolExecutor两种调度方式的基准测试
+
+对比scheduler='fifo'(所有worker共用一个queue.Queue)和scheduler='stealing'
+(每个worker一个deque，互相偷item). 每种组合提交N个非常小的任务(microtask),
+测量从第一次submit到所有结果都拿到的时间. 结果以JSON输出:
+
+    python bench_thread.py > sched.json
+    python bench_thread.py --workers 32 64 --tasks 100000
+"""
+
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from thread import ThreadPoolExecutor
+
+
+SCHEDULERS = ('fifo', 'stealing')
+WORKERS = (4, 16, 32, 64)
+
+
+def microtask(x):
+    return x + 1
+
+
+def run_submit(executor, tasks):
+    """ 一个生产者逐个submit """
+    futures = [executor.submit(microtask, i) for i in range(tasks)]
+    for f in futures:
+        f.result()
+
+
+def run_fanout(executor, tasks, producers=8):
+    """ 多个任务同时submit子任务，生产者也在池子里 """
+    per = tasks // producers
+
+    def produce(base):
+        return [executor.submit(microtask, base + i) for i in range(per)]
+
+    for batch in [executor.submit(produce, p * per) for p in range(producers)]:
+        for f in batch.result():
+            f.result()
+
+
+SCENARIOS = {'submit': run_submit, 'fanout': run_fanout}
+
+
+def bench(scheduler, workers, tasks, scenario, repeat):
+    timings = []
+    for _ in range(repeat):
+        executor = ThreadPoolExecutor(max_workers=workers, scheduler=scheduler)
+        # 先把线程都启动起来，不把创建线程的时间算进去
+        for f in [executor.submit(time.sleep, 0.01) for _ in range(workers)]:
+            f.result()
+        start = time.perf_counter()
+        SCENARIOS[scenario](executor, tasks)
+        timings.append(time.perf_counter() - start)
+        executor.shutdown()
+    best = min(timings)
+    return {
+        'scheduler': scheduler,
+        'workers': workers,
+        'scenario': scenario,
+        'tasks': tasks,
+        'best_s': round(best, 4),
+        'tasks_per_s': int(tasks / best),
+    }
+
+
+def main(argv):
+    parser = ArgumentParser(prog=argv[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=WORKERS,
+                        help='pool sizes (default: %(default)s)')
+    parser.add_argument('--tasks', type=int, default=50000, help='microtasks per run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per combination, best is kept')
+    parser.add_argument('--scenarios', nargs='+', default=sorted(SCENARIOS),
+                        choices=sorted(SCENARIOS))
+    args = parser.parse_args(argv[1:])
+
+    results = [bench(scheduler, workers, args.tasks, scenario, args.repeat)
+               for scenario in args.scenarios
+               for workers in args.workers
+               for scheduler in SCHEDULERS]
+    json.dump({'python': sys.version.split()[0], 'cpus': os.cpu_count(),
+               'results': results}, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -6,9 +6,14 @@
 __author__ = 'Brian Quinlan (brian@sweetapp.com)'
 
 import atexit
+import collections
 from concurrent.futures import _base
+from functools import partial
+import heapq
+import itertools
 import queue
 import threading
+import time
 import weakref
 import os
 
@@ -43,13 +48,18 @@ atexit.register(_python_exit)
 
 class _WorkItem(object):
 
-    def __init__(self, future, fn, args, kwargs):
+    def __init__(self, future, fn, args, kwargs, priority=0, deadline=None):
         self.future = future
         self.fn = fn
         self.args = args
         self.kwargs = kwargs
+        self.priority = priority
+        self.deadline = deadline
 
     def run(self):
+        # 开始之前已经过了deadline，取消它而不是浪费worker去执行
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.future.cancel()
         if not self.future.set_running_or_notify_cancel():
             return
 
@@ -59,15 +69,200 @@ class _WorkItem(object):
             self.future.set_exception(e)
         else:
             self.future.set_result(result)
-        
 
-def _worker(executor_reference, worker_queue):
+
+class _BatchWorkItem(object):
+    """一次put放进队列的一组调用，每个调用有自己的future.
+    
+    worker按顺序执行它们，已经被取消的调用会被跳过。
+    """
+
+    priority = 0
+
+    def __init__(self, futures, fn, args_list):
+        self.futures = futures
+        self.fn = fn
+        self.args_list = args_list
+
+    def run(self):
+        fn = self.fn
+        for future, args in zip(self.futures, self.args_list):
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+def _get_chunks(*iterables, chunksize):
+    """把zip(*iterables)的参数分割成大小为chunksize的tuple"""
+    it = zip(*iterables)
+    while True:
+        chunk = tuple(itertools.islice(it, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_chunk(fn, chunk):
+    """在一个worker里执行一整个chunk，返回结果的list"""
+    return [fn(*args) for args in chunk]
+
+
+_EMPTY = object()
+
+
+class _WorkStealingQueue(object):
+    """work stealing调度：每个worker有一个自己的deque
+
+    put()把item轮流(round-robin)放进各个worker的deque，如果有worker在
+    睡眠，就直接放进它的deque再唤醒它。worker先从自己deque的头部取,
+    自己的deque空了就从其它worker的deque尾部"偷"一个。deque的append/
+    popleft/pop本身是原子的，所以有item可取的时候不需要任何共享的锁,
+    只有worker没事可做、需要睡眠的时候才用到Event.
+
+    接口是queue.Queue的一个子集(put, get, qsize)，_worker不需要知道
+    用的是哪种队列。
+    """
+
+    def __init__(self):
+        self._deques = []                       # [(线程, deque)]，只整体替换
+        self._inject = collections.deque()      # 还没有worker注册时放在这里
+        self._sleepers = collections.deque()    # 正在睡眠的worker: (Event, deque)
+        self._counter = itertools.count()
+        self._local = threading.local()
+        self._register_lock = threading.Lock()
+
+    def _own(self):
+        """返回当前worker线程自己的deque，第一次调用时注册"""
+        own = getattr(self._local, 'deque', None)
+        if own is None:
+            own = self._local.deque = collections.deque()
+            self._local.sleeper = (threading.Event(), own)
+            with self._register_lock:
+                # 顺便去掉已经退出的线程留下的空deque
+                self._deques = [(t, d) for t, d in self._deques if d or t.is_alive()]
+                self._deques.append((threading.current_thread(), own))
+        return own
+
+    def _take(self, own):
+        try:
+            return own.popleft()
+        except IndexError:
+            pass
+        try:
+            return self._inject.popleft()
+        except IndexError:
+            pass
+        deques = self._deques
+        n = len(deques)
+        start = next(self._counter)
+        for i in range(n):
+            victim = deques[(start + i) % n][1]
+            if victim and victim is not own:
+                try:
+                    return victim.pop()
+                except IndexError:
+                    pass
+        return _EMPTY
+
+    def put(self, item):
+        try:
+            event, target = self._sleepers.popleft()
+        except IndexError:
+            deques = self._deques
+            if deques:
+                deques[next(self._counter) % len(deques)][1].append(item)
+            else:
+                self._inject.append(item)
+        else:
+            # 直接交给睡眠的worker，它醒来后在自己的deque里就能找到
+            target.append(item)
+            event.set()
+
+    def get(self, block=True, timeout=None):
+        own = self._own()
+        item = self._take(own)
+        if item is not _EMPTY:
+            return item
+        if not block:
+            raise queue.Empty
+
+        sleeper = self._local.sleeper
+        event = sleeper[0]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # 先登记再检查一次，避免错过在这之间put的item
+            event.clear()
+            self._sleepers.append(sleeper)
+            item = self._take(own)
+            if item is _EMPTY:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is None or remaining > 0:
+                    event.wait(remaining)
+                    item = self._take(own)
+            try:
+                self._sleepers.remove(sleeper)
+            except ValueError:
+                # put()已经选中了这个worker，等它把item放进来，
+                # 否则item可能留在一个即将退休的worker的deque里
+                event.wait()
+                if item is _EMPTY:
+                    item = self._take(own)
+            if item is not _EMPTY:
+                return item
+            if deadline is not None and time.monotonic() >= deadline:
+                raise queue.Empty
+
+    def qsize(self):
+        return len(self._inject) + sum(len(d) for _, d in self._deques)
+
+
+class _PriorityWorkQueue(queue.PriorityQueue):
+    """按item.priority排序的堆队列：数值小的先执行，priority相同时
+    按提交的顺序. 退出信号None排在所有item之后，shutdown()仍然会
+    先执行完已经提交的item.
+    """
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._seq = itertools.count()
+
+    def _put(self, item):
+        priority = float('inf') if item is None else item.priority
+        heapq.heappush(self.queue, (priority, next(self._seq), item))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
+
+def _worker(executor_reference, work_queue, keep_alive=None):
     try:
         while True:
-            work_item = work_queue.get(block=True)
+            try:
+                work_item = work_queue.get(block=True, timeout=keep_alive)
+            except queue.Empty:
+                # 闲置超过keep_alive秒，尝试退休
+                executor = executor_reference()
+                if executor is None or executor._retire_idle_worker():
+                    return
+                del executor
+                continue
             if work_item is not None:
                 work_item.run()
+                # 释放引用，避免在闲置期间一直持有结果
                 del work_item
+
+                # 告诉executor多了一个闲置的worker
+                executor = executor_reference()
+                if executor is not None:
+                    with executor._idle_lock:
+                        executor._idle_workers += 1
+                del executor
                 continue
             executor = executor_reference()
             # 在下面情况下退出:
@@ -82,14 +277,25 @@ def _worker(executor_reference, worker_queue):
     except BaseException:
         _base.LOGGER.critical('Exception in worker', exc_info=True)
 
-    
+
 class ThreadPoolExecutor(_base.Executor):
 
-    def __init__(self, max_workers=None):
+    _schedulers = {'fifo': queue.Queue, 'stealing': _WorkStealingQueue,
+                   'priority': _PriorityWorkQueue}
+
+    def __init__(self, max_workers=None, keep_alive=None, scheduler='fifo'):
         """初始化一个新的ThreadPoolExecutor实例
 
         参数：
-            max_workers: 开启的最大线程数量.
+            max_workers: 开启的最大线程数量.
+            keep_alive: 闲置的线程在这么多秒之后退出，None表示一直保留.
+                突发的任务结束以后，线程池会慢慢收缩，不会一直占着
+                (cpu_count * 5)个线程.
+            scheduler: 'fifo'表示所有worker共用一个queue.Queue;
+                'stealing'表示每个worker有自己的deque，闲置的worker从其它
+                worker那里偷item(见_WorkStealingQueue)，线程很多而每个
+                item又很小的时候，可以避免所有worker争抢同一个锁;
+                'priority'表示按submit()的priority参数排序的堆队列.
         """
         if max_workers is None:
             # 使用这个数量的worker，因为线程通常是进行I/O任务,
@@ -97,47 +303,183 @@ class ThreadPoolExecutor(_base.Executor):
             max_workers = (os.cpu_count() or 1) * 5
         if max_workers <= 0:
             raise ValueError("max_workers must be greater than 0")
-        
+        if keep_alive is not None and keep_alive <= 0:
+            raise ValueError("keep_alive must be greater than 0")
+        if scheduler not in self._schedulers:
+            raise ValueError("scheduler must be one of %s" % ', '.join(sorted(self._schedulers)))
+
         self._max_workers = max_workers
-        self._worker.queue = queue.Queue()
+        self._keep_alive = keep_alive
+        self._work_queue = self._schedulers[scheduler]()
+        # 线程数减去还没完成的item数: 大于0时有闲置的worker,
+        # 小于0时表示线程已经满了，item在队列里排队
+        self._idle_workers = 0
+        self._idle_lock = threading.Lock()
         self._threads = set()
         self._shutdown = False
         self._shutdown_lock = threading.Lock()
 
-    def submit(self, fn, *args, **kwargs):
+    def submit(self, fn, *args, priority=None, deadline=None, **kwargs):
+        """提交一个可调用对象，以`fn(*args, **kwargs)`的方式执行.
+
+        参数:
+            priority: 数值越小越先执行，只能用于scheduler='priority'.
+                None等同于0.
+            deadline: 一个time.monotonic()的时间点. 如果在开始执行之前
+                已经过了这个时间，future会被取消(cancelled())，不会占用
+                worker去执行它.
+
+        返回:
+            一个代表可调用对象执行的Future实例.
+        """
+        if priority is not None and not isinstance(self._work_queue, _PriorityWorkQueue):
+            raise ValueError("priority requires scheduler='priority'")
+
         with self._shutdown_lock:
             if self._shutdown:
-                raise RuntimError('cannot schedule new futures after shutdown!')
+                raise RuntimeError('cannot schedule new futures after shutdown')
 
             f = _base.Future()
-            w = _WorkItem(f, fn, args, kwargs)
+            w = _WorkItem(f, fn, args, kwargs, priority or 0, deadline)
 
-            self._worker_queue.put(w)
+            self._work_queue.put(w)
             self._adjust_thread_count()
             return f
-    submit.__doc__ = _base.Exception.submit.__doc__
+
+    def submit_many(self, fn, iterable, chunksize=None):
+        """对iterable中的每一组参数调度一次`fn(*args)`，返回future的list
+
+        调用被分成大小为chunksize的批次，每个批次只需要一次队列的put,
+        由一个worker依次执行。future的顺序和iterable一致。
+
+        参数:
+            fn: 一个可调用对象。
+            iterable: 参数tuple的可迭代对象，就像`itertools.starmap`.
+            chunksize: 每个批次的调用数量。None表示让每个worker
+                大约分到4个批次。
+        """
+        args_list = [tuple(args) for args in iterable]
+        if chunksize is None:
+            chunksize = max(1, len(args_list) // (self._max_workers * 4))
+        if chunksize < 1:
+            raise ValueError("chunksize must be >= 1.")
+
+        futures = [_base.Future() for _ in args_list]
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+
+            for i in range(0, len(args_list), chunksize):
+                self._work_queue.put(_BatchWorkItem(futures[i:i + chunksize], fn,
+                                                    args_list[i:i + chunksize]))
+                self._adjust_thread_count()
+        return futures
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1, prefetch=None):
+        """返回一个迭代器，等同于`map(fn, iter)`
+
+        chunksize大于1时，参数被分割成这个大小的chunk，每个chunk只有一个
+        Future和一次队列的put，结果仍然按顺序返回。对于大量非常小的调用,
+        这可以大幅减少调度的开销。一个chunk中的调用抛出的异常会在迭代到
+        这个chunk时抛出。
+
+        prefetch不为None时，最多只有这么多个调用(或者chunk)同时在执行或者
+        排队，每取走一个结果才提交下一个，流式的输入只占用固定的内存。
+        None表示一开始就提交所有调用。
+        """
+        if chunksize < 1:
+            raise ValueError("chunksize must be >= 1.")
+        if prefetch is not None and prefetch < 1:
+            raise ValueError("prefetch must be >= 1.")
+
+        if chunksize > 1:
+            fn = partial(_run_chunk, fn)
+            iterables = (_get_chunks(*iterables, chunksize=chunksize),)
+        if prefetch is None:
+            results = super().map(fn, *iterables, timeout=timeout)
+        else:
+            results = self._map_prefetch(fn, zip(*iterables), timeout, prefetch)
+        if chunksize > 1:
+            return itertools.chain.from_iterable(results)
+        return results
+
+    def _map_prefetch(self, fn, args_iter, timeout, prefetch):
+        """map()的prefetch模式：最多prefetch个调用同时在执行或者排队,
+        每取走一个结果才提交下一个，所以args_iter可以是无限的生成器.
+        """
+        if timeout is not None:
+            end_time = timeout + time.monotonic()
+
+        # 前prefetch个future在首个结果被要求之前就提交
+        fs = collections.deque(self.submit(fn, *args)
+                               for args in itertools.islice(args_iter, prefetch))
+
+        def result_iterator():
+            try:
+                while fs:
+                    future = fs.popleft()
+                    if timeout is None:
+                        result = future.result()
+                    else:
+                        result = future.result(end_time - time.monotonic())
+                    del future
+                    # 在交出结果之前补充一个调用，调用方处理结果的时候
+                    # 仍然有prefetch个调用在执行
+                    for args in itertools.islice(args_iter, 1):
+                        fs.append(self.submit(fn, *args))
+                    yield result
+                    del result
+            finally:
+                for future in fs:
+                    future.cancel()
+        return result_iterator()
 
     def _adjust_thread_count(self):
+        # 如果有闲置的worker，由它来处理新的item，不需要创建新线程.
+        # 减掉一个计数相当于"预定"了这个worker
+        with self._idle_lock:
+            self._idle_workers -= 1
+            if self._idle_workers >= 0:
+                return
+
         # 在executor丢失以后，weakref的callback
         # 会唤醒worker线程
         def weakref_cb(_, q=self._work_queue):
             q.put(None)
-        # TODO(bquinlan): 如果闲置的线程比work queue
-        # 里面的itme还多，应该避免创建新的线程
+
         if len(self._threads) < self._max_workers:
             t = threading.Thread(target=_worker,
                                  args=(weakref.ref(self, weakref_cb),
-                                      self._work_queue))
+                                       self._work_queue,
+                                       self._keep_alive))
             t.daemon = True
             t.start()
             self._threads.add(t)
-            _threads_queues[t] = self._worker_queue
+            _threads_queues[t] = self._work_queue
+            with self._idle_lock:
+                self._idle_workers += 1
+
+    def _retire_idle_worker(self):
+        """由闲置超时的worker调用，返回True表示这个worker可以退出
+
+        只有线程数多于还没完成的item数时才能退出，否则submit()刚刚
+        "预定"了它，它应该回去处理item. 持有_shutdown_lock,
+        和submit()中的put + _adjust_thread_count互斥.
+        """
+        with self._shutdown_lock, self._idle_lock:
+            if self._shutdown or self._idle_workers <= 0:
+                return False
+            self._idle_workers -= 1
+            t = threading.current_thread()
+            self._threads.discard(t)
+            _threads_queues.pop(t, None)
+            return True
 
     def shutdown(self, wait=True):
         with self._shutdown_lock:
             self._shutdown = True
-            self.work_queue.put(None)
+            self._work_queue.put(None)
         if wait:
-            for t in self._threads:
+            for t in list(self._threads):
                 t.join()
-    shutdown.__doc__ = _base.Executor.__doc__
\ No newline at end of file
+    shutdown.__doc__ = _base.Executor.shutdown.__doc__
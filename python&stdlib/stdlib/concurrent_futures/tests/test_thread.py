@@ -0,0 +1,175 @@
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source'))
+from thread import ThreadPoolExecutor
+
+
+SCHEDULERS = ('fifo', 'stealing', 'priority')
+
+
+def wait_until(predicate, timeout=5):
+    end = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def jitter(x):
+    time.sleep(random.random() / 1000)
+    return x * 2
+
+
+@pytest.fixture
+def blocked():
+    """只有一个worker的线程池，worker被一个等待Event的任务占住"""
+    executor = ThreadPoolExecutor(max_workers=1, scheduler='priority')
+    gate = threading.Event()
+    executor.submit(gate.wait)
+    yield executor, gate
+    gate.set()
+    executor.shutdown()
+
+
+@pytest.mark.parametrize('scheduler', SCHEDULERS)
+def test_idle_thread_is_reused(scheduler):
+    with ThreadPoolExecutor(max_workers=4, scheduler=scheduler) as executor:
+        idents = {executor.submit(threading.get_ident).result() for _ in range(20)}
+
+        assert len(idents) == 1
+        assert len(executor._threads) == 1
+
+
+@pytest.mark.parametrize('scheduler', SCHEDULERS)
+def test_keep_alive_retires_idle_threads(scheduler):
+    with ThreadPoolExecutor(max_workers=8, keep_alive=0.05, scheduler=scheduler) as executor:
+        list(executor.map(jitter, range(100)))
+        assert executor._threads
+
+        assert wait_until(lambda: not executor._threads)
+        assert executor._idle_workers == 0
+        assert executor.submit(jitter, 21).result(timeout=5) == 42
+
+
+@pytest.mark.parametrize('scheduler', SCHEDULERS)
+def test_keep_alive_under_submit_churn(scheduler):
+    # 提交的间隔和keep_alive差不多长，worker不断地退休、被重新创建,
+    # 一个item都不能丢在已经退出的worker那里
+    executor = ThreadPoolExecutor(max_workers=4, keep_alive=0.005, scheduler=scheduler)
+    futures, lock = [], threading.Lock()
+
+    def submitter(seed):
+        rnd = random.Random(seed)
+        for i in range(200):
+            f = executor.submit(jitter, i)
+            with lock:
+                futures.append((i, f))
+            time.sleep(rnd.random() / 100)
+
+    submitters = [threading.Thread(target=submitter, args=(n,)) for n in range(4)]
+    for t in submitters:
+        t.start()
+    for t in submitters:
+        t.join()
+
+    try:
+        for i, f in futures:
+            assert f.result(timeout=5) == i * 2
+        assert len(executor._threads) <= 4
+        assert wait_until(lambda: not executor._threads)
+        assert executor._idle_workers == 0
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.parametrize('chunksize', [1, 3, 7, 1000])
+def test_map_chunksize_keeps_order(chunksize):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(jitter, range(100), chunksize=chunksize)) == \
+            [x * 2 for x in range(100)]
+
+
+@pytest.mark.parametrize('chunksize', [1, 5])
+@pytest.mark.parametrize('prefetch', [1, 3, 16])
+def test_map_prefetch_keeps_order(prefetch, chunksize):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = executor.map(jitter, range(100), chunksize=chunksize, prefetch=prefetch)
+
+        assert list(results) == [x * 2 for x in range(100)]
+
+
+def test_map_prefetch_bounds_in_flight_calls():
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def track(x):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.001)
+        with lock:
+            running[0] -= 1
+        return x
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        # 无限的输入也可以，只提交取走结果需要的那么多
+        results = executor.map(track, itertools.count(), prefetch=3)
+
+        assert list(itertools.islice(results, 50)) == list(range(50))
+        assert peak[0] <= 3
+
+
+def test_map_invalid_arguments():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(ValueError):
+            executor.map(jitter, range(3), chunksize=0)
+        with pytest.raises(ValueError):
+            executor.map(jitter, range(3), prefetch=0)
+
+
+def test_priority_order(blocked):
+    executor, gate = blocked
+    order = []
+    priorities = [5, 1, 3, 1, 0, 4, 3, 2]
+    futures = [executor.submit(order.append, (p, i), priority=p)
+               for i, p in enumerate(priorities)]
+    gate.set()
+    for f in futures:
+        f.result(timeout=5)
+
+    # 数值小的先执行，priority相同时按提交顺序
+    assert order == sorted((p, i) for i, p in enumerate(priorities))
+
+
+def test_priority_requires_priority_scheduler():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(ValueError):
+            executor.submit(jitter, 1, priority=1)
+
+
+def test_deadline_cancels_queued_item(blocked):
+    executor, gate = blocked
+    called = []
+    late = executor.submit(called.append, 'late', deadline=time.monotonic() + 0.02)
+    on_time = executor.submit(called.append, 'on_time', deadline=time.monotonic() + 60)
+    time.sleep(0.05)
+    gate.set()
+
+    assert on_time.result(timeout=5) is None
+    assert late.cancelled()
+    assert called == ['on_time']
+
+
+def test_deadline_does_not_interrupt_running_item():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        f = executor.submit(time.sleep, 0.05, deadline=time.monotonic() + 0.01)
+
+        assert f.result(timeout=5) is None
+        assert not f.cancelled()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""import bottle的启动时间基准测试
+
+在一个干净的子进程里运行`python -X importtime -c "import bottle"`，解析stderr里的
+importtime输出，给出bottle本身的累计耗时以及最慢的几个依赖模块．每次测量都是
+独立的进程(没有sys.modules缓存)，结果取多次运行的中位数，以JSON输出:
+
+    python bench_import.py > before.json
+    python bench_import.py --budget-ms 15      # 超出预算时返回码为1，可以放进CI
+"""
+
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_importtime(output):
+    """ 解析`-X importtime`的输出，返回[(module, self_us, cumulative_us), ...]
+
+        每一行的格式是`import time: <self> | <cumulative> | <indent><module>`
+    """
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # 表头那一行
+        rows.append((parts[2].strip(), self_us, cumulative_us))
+    return rows
+
+
+def measure(python, module):
+    env = dict(os.environ, PYTHONPATH=HERE)
+    # 否则预热时不会写.pyc，每次测量的都是编译bottle.py的时间
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    proc = subprocess.Popen([python, '-X', 'importtime', '-c', 'import ' + module],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=env, universal_newlines=True)
+    _, err = proc.communicate()
+    if proc.returncode:
+        raise RuntimeError('import %s failed:\n%s' % (module, err))
+    return parse_importtime(err)
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def main(argv):
+    parser = ArgumentParser(prog=argv[0])
+    parser.add_argument('--runs', type=int, default=10, help='number of fresh interpreters')
+    parser.add_argument('--top', type=int, default=10, help='slowest dependencies to report')
+    parser.add_argument('--module', default='bottle', help='module to import')
+    parser.add_argument('--python', default=sys.executable, help='interpreter to measure')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='exit with status 1 if the median import time exceeds this')
+    args = parser.parse_args(argv[1:])
+
+    measure(args.python, args.module)  # 预热一次，让.pyc都写好
+    totals, selfs = [], {}
+    for _ in range(args.runs):
+        rows = measure(args.python, args.module)
+        for name, self_us, cumulative_us in rows:
+            selfs.setdefault(name, []).append(self_us)
+            if name == args.module:
+                totals.append(cumulative_us)
+
+    slowest = sorted(((median(v), k) for k, v in selfs.items() if k != args.module),
+                     reverse=True)[:args.top]
+    total_ms = median(totals) / 1e3
+    result = {
+        'python': sys.version.split()[0],
+        'module': args.module,
+        'runs': args.runs,
+        'import_ms': round(total_ms, 3),
+        'modules_loaded': len(selfs),
+        'slowest_self_us': [{'module': k, 'us': v} for v, k in slowest],
+    }
+    if args.budget_ms is not None:
+        result['budget_ms'] = args.budget_ms
+        result['within_budget'] = total_ms <= args.budget_ms
+
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 0 if result.get('within_budget', True) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
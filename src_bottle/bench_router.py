@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""bottle.Router的基准测试
+
+生成10, 1k, 10k条rule的合成路由表(混合静态路由, `<name>`, `<id:int>`, `<p:path>`
+以及旧式的`:name`语法), 测量add耗时，match/build延迟的百分位数以及每条路由占用的内存．
+结果以JSON输出，方便在不同的commit之间比较:
+
+    python bench_router.py > before.json
+    python bench_router.py --radix --cache-size 1024 > after.json
+"""
+
+import json
+import random
+import sys
+import time
+import tracemalloc
+import warnings
+from argparse import ArgumentParser
+
+from bottle import Router
+
+
+SIZES = (10, 1000, 10000)
+
+# 每一种rule的模板，以及匹配它的路径模板
+KINDS = (
+    ('/static/s%d/index', '/static/s%d/index'),
+    ('/user%d/<name>', '/user%d/bob'),
+    ('/item%d/<id:int>', '/item%d/42'),
+    ('/files%d/<p:path>', '/files%d/a/b/c.txt'),
+    ('/legacy%d/:name', '/legacy%d/alice'),
+)
+
+
+def make_routes(n):
+    """ 返回n个(rule, method, name, path, build_kwargs)元组，各种rule轮流出现 """
+    routes = []
+    for i in range(n):
+        rule, path = KINDS[i % len(KINDS)]
+        rule, path = rule % i, path % i
+        if '<name>' in rule or ':name' in rule:
+            kwargs = {'name': 'bob'}
+        elif '<id:int>' in rule:
+            kwargs = {'id': 42}
+        elif '<p:path>' in rule:
+            kwargs = {'p': 'a/b/c.txt'}
+        else:
+            kwargs = {}
+        routes.append((rule, 'GET', 'r%d' % i, path, kwargs))
+    return routes
+
+
+def percentiles(samples, points=(50, 90, 99, 99.9)):
+    """ 返回样本(秒)的百分位数，单位是微秒 """
+    samples = sorted(samples)
+    result = {}
+    for p in points:
+        index = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+        result['p%s' % p] = round(samples[index] * 1e6, 3)
+    result['mean'] = round(sum(samples) / len(samples) * 1e6, 3)
+    return result
+
+
+def bench(n, samples, router_args):
+    routes = make_routes(n)
+
+    router = Router(**router_args)
+    start = time.perf_counter()
+    for rule, method, name, _, _ in routes:
+        router.add(rule, method, name, name=name)
+    add_time = time.perf_counter() - start
+
+    # tracemalloc会拖慢add，所以内存在另一个Router上单独测量
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    other = Router(**router_args)
+    for rule, method, name, _, _ in routes:
+        other.add(rule, method, name, name=name)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del other
+
+    rnd = random.Random(n)
+    picks = [rnd.choice(routes) for _ in range(samples)]
+    timer = time.perf_counter
+
+    match_times = []
+    for _, method, _, path, _ in picks:
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path}
+        t = timer()
+        router.match(environ)
+        match_times.append(timer() - t)
+
+    build_times = []
+    for _, _, name, _, kwargs in picks:
+        t = timer()
+        router.build(name, **kwargs)
+        build_times.append(timer() - t)
+
+    return {
+        'routes': n,
+        'add_total_ms': round(add_time * 1e3, 3),
+        'add_per_route_us': round(add_time / n * 1e6, 3),
+        'match_us': percentiles(match_times),
+        'build_us': percentiles(build_times),
+        'memory_per_route_bytes': round(memory / float(n), 1),
+    }
+
+
+def main(argv):
+    parser = ArgumentParser(prog=argv[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='route table sizes (default: %(default)s)')
+    parser.add_argument('--samples', type=int, default=10000,
+                        help='match/build calls per table')
+    parser.add_argument('--radix', action='store_true', help='use Router(radix=True)')
+    parser.add_argument('--strict', action='store_true', help='use Router(strict=True)')
+    parser.add_argument('--cache-size', type=int, default=0, help='Router(cache_size=N)')
+    args = parser.parse_args(argv[1:])
+
+    router_args = dict(strict=args.strict, radix=args.radix, cache_size=args.cache_size)
+    with warnings.catch_warnings():
+        # 旧式的`:name`语法会触发DeprecationWarning
+        warnings.simplefilter('ignore', DeprecationWarning)
+        results = [bench(n, args.samples, router_args) for n in args.sizes]
+
+    json.dump({'python': sys.version.split()[0], 'router': router_args,
+               'results': results}, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -35,11 +35,15 @@ def _cli_parse(args):
     opt = parser.add_argument       
     opt("--version", action="store_true", help="show version number.")
     opt("-b", "--bind", metavar="ADDRESS", help="bind socket to ADDRESS.")
-    opt("-s", "--server", default='wsgiref', help="use SERVER as backend.")
+    opt("-s", "--server", default='wsgiref',
+        help="use SERVER as backend (wsgiref, prefork, threaded, asyncio or package.module:Adapter).")
+    opt("-w", "--workers", type=int, metavar="N",
+        help="prefork: worker processes (default: CPU count); "
+             "threaded/asyncio: pool threads.")
     opt("-p", "--plugin", action='append', help='install additional plugin/s.')
     opt("-c", "--conf", action="append", metavar="FILE", help="load config values from FILE.")
     opt("-C", "--param", action="append", metavar="NAME=VALUE",
-        help="load config values from FILE.")
+        help="override config values.")
     opt("--debug", action="store_true", help="start server in debug mode.")
     opt("--reload", action="store_true", help="auto-reload on file changes.")
     opt("app", help="WSGI app entry point.", nargs='?')
@@ -70,15 +74,63 @@ if __name__ == "__main__":
 ###############################################################################
 
 
-import base64, cgi, email.utils, functools, hmac, imp, itertools, mimetypes,\
-        os, re, tempfile, threading, time, warnings, weakref, hashlib
+import functools, itertools, os, re, threading, time, warnings, weakref
+
+
+class _LazyModule(object):
+    """ 模块的代理对象，第一次访问属性时才真正import．
+
+        import之后，模块全局变量中指向这个代理的名称会被替换为真正的模块，
+        之后的访问就不再经过代理．`target`用于`email.utils`这种情况：
+        import的是子模块，但是全局变量绑定的是顶层的包．
+    """
+
+    def __init__(self, name, target=None):
+        self._name = name
+        self._target = target or name
+
+    def _load(self):
+        __import__(self._name)
+        module = sys.modules[self._target]
+        scope = globals()
+        for key, value in list(scope.items()):
+            if value is self:
+                scope[key] = module
+        return module
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self._name
+
+
+# 下面这些模块只在处理请求或者启动服务器时才用得到，import bottle时不去加载它们
+binascii = _LazyModule('binascii')
+email = _LazyModule('email.utils', 'email')
+hashlib = _LazyModule('hashlib')
+hmac = _LazyModule('hmac')
+mimetypes = _LazyModule('mimetypes')
+socket = _LazyModule('socket')
+tempfile = _LazyModule('tempfile')
+traceback = _LazyModule('traceback')
 
 from types import FunctionType
+from collections import OrderedDict
 from datetime import date as datedate, datetime, timedelta          # >> 这有一个 as 语句，将date昵称化为datedate，消除可能的歧义
-from tempfile import TemporaryFile                                  # >> 同时import了tempfile和tempfile.TemporaryFile，是否多余？？？
-from traceback import format_exc, print_exc
 from unicodedata import normalize
 
+
+def format_exc(*args, **kwargs):
+    return traceback.format_exc(*args, **kwargs)
+
+
+def print_exc(*args, **kwargs):
+    return traceback.print_exc(*args, **kwargs)
+
+
 try:
     from ujson import dumps as json_dumps, loads as json_lds        # >> 作者似乎代码量节省的有些过分(但是是在消灭歧义的前提下)
 except ImportError:
@@ -88,56 +140,64 @@ except ImportError:
 # 在Python3.6中，inspect.getargspec已经被移除
 # 使用我们能用的Signature版本(Python3.3+)
 # >> 一个框架，不得不包含这些多余的代码，才可以设定通用的接口以及适配版本迁移
-try:
-    from inspect import signature
-    def getargspec(func):                                           # >> 这个函数的作用似乎是为了获取一个函数对象的参数签名
-        params = signature(func).parameters
-        args, varargs, keywords, defaults = [], None, None, []
-        for name, param in params.items():
-            if param.kind == param.VAR_POSITIONAL:
-                varargs = name
-            elif param.kind == param.VAR_KEYWORD:
-                keywords = name
-            else:
-                args.append(name)
-                if param.default is not param.empty:
-                    defaults.append(param.default)
-        return (args, varargs, keywords, tuple(defaults) or None)      
-except ImportError:
+# inspect的import很慢(它会带进ast, dis, tokenize...)，第一次调用时才去import
+def _make_getargspec():
     try:
-        from inspect import getfullargspec
-        def getargspec(func):
-            spec = getfullargspec(func)
-            kwargs = makelist(spec[0]) + makelist(spec.kwonlyargs)  # >> 这时makelist()函数还没有出现，但是我可以剧透一下：这个函数的作用是将对象转换为列表(如果可能)
-            return kwargs, spec[1], spec[2], spec[3]                # >> 这里作者没有使用*来unpack, 另外好像和上面定义的函数返回的顺序不一样？？？  
+        from inspect import signature
+        def getargspec(func):                                           # >> 这个函数的作用似乎是为了获取一个函数对象的参数签名
+            params = signature(func).parameters
+            args, varargs, keywords, defaults = [], None, None, []
+            for name, param in params.items():
+                if param.kind == param.VAR_POSITIONAL:
+                    varargs = name
+                elif param.kind == param.VAR_KEYWORD:
+                    keywords = name
+                else:
+                    args.append(name)
+                    if param.default is not param.empty:
+                        defaults.append(param.default)
+            return (args, varargs, keywords, tuple(defaults) or None)      
     except ImportError:
-        from inspect import getargspec
+        try:
+            from inspect import getfullargspec
+            def getargspec(func):
+                spec = getfullargspec(func)
+                kwargs = makelist(spec[0]) + makelist(spec.kwonlyargs)  # >> 这时makelist()函数还没有出现，但是我可以剧透一下：这个函数的作用是将对象转换为列表(如果可能)
+                return kwargs, spec[1], spec[2], spec[3]                # >> 这里作者没有使用*来unpack, 另外好像和上面定义的函数返回的顺序不一样？？？  
+        except ImportError:
+            from inspect import getargspec
+    return getargspec
+
 
-py3k = sys.version_info.marjor > 2
+def getargspec(func):
+    global getargspec
+    getargspec = _make_getargspec()
+    return getargspec(func)
+
+py3k = sys.version_info.major > 2
 
 
 # python2/3中的"print"关键字/函数"的变化是个棘手的问题
 # 应对mod_wsgi也是个问题(限制了 stdout/err 属性的访问)
 # >> 奇怪为什么不使用__future__模块？？？
 try:
-    _stdout, _stderr = sys.stdout.write, sys.stderr.out
+    _stdout, _stderr = sys.stdout.write, sys.stderr.write
 except IOError:           # >> 震惊作者对于Exception的理解
     _stdout = lambda x: sys.stdout.write(x)
-    stderr = lambda x: sys.stderr.write(x)
+    _stderr = lambda x: sys.stderr.write(x)
 
 # 一大堆标准库和内置函数的不同需要处理
 # >> 作者显然是以Py2的接口名为标准
 if py3k:
-    import http.client as httplib
+    httplib = _LazyModule('http.client')
     import _thread as thread
     from urllib.parse import urljoin, SplitResult as UrlSplitResult
     from urllib.parse import urlencode, quote as urlquote, unquote as urlunquote
     urlunquote = functools.partial(urlunquote, encoding='latin1')                   # >> urlunquote()函数在Py3中似乎没有指定一个默认值参数encoding
-    from http.cookies import SimpleCookie, Morsel, CookieError
-    from collections import MutableMapping as DictMixin
-    import pickle
+    _cookies = _LazyModule('http.cookies')
+    from collections.abc import MutableMapping as DictMixin                         # >> Python3.3起ABC移到了collections.abc，3.10中旧名称被移除
     from io import BytesIO
-    import configparser
+    configparser = _LazyModule('configparser')
 
     basestring = str
     unicode = str
@@ -149,27 +209,34 @@ if py3k:
     def _raise(*a):
         raise a[0](a[1]).with_traceback(a[2])                                       # >> 奇怪的函数_raise()？？？
 else: # Py2的import
-    import httplib
+    httplib = _LazyModule('httplib')
     import thread
     from urlparse import urljoin, SplitResult as UrlSplitResult
     from urllib import urlencode, quote as urlquote, unquote as urlunquote
-    from Cookie import SimpleCookie, Morsel, CookieError
+    _cookies = _LazyModule('Cookie')
     from iterttols import imap
-    import cPickle as pickle
     from StringIO import StringIO as BytesIO                                        # >> 这里的接口名称又是以Py3为标准，但是消除了歧义(作者对标准库有很强的理解)
-    import ConfigParser as configparser                                             # >> 这个接口也是以Py3为标准，看起来更加的PEP8
+    configparser = _LazyModule('ConfigParser')                                       # >> 这个接口也是以Py3为标准，看起来更加的PEP8
     from collections import MutableMapping as DictMixin
     unicode = unicode
     json_loads = json_lds
     exec(compile('def _raise(*a): raise a[0], a[1], a[2]', '<py3fix>', 'exec'))     # >> 又是_raise()函数，compile()又是什么鬼？
 
 
+def __getattr__(name):
+    """ 模块级别的__getattr__(PEP 562)：`bottle.SimpleCookie`这些名称在
+        第一次访问时才去import http.cookies """
+    if name in ('SimpleCookie', 'Morsel', 'CookieError'):
+        return getattr(_cookies, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 # string/byte处理的帮助函数
 # >> 这两个函数有点意思
 def tob(s, enc='utf8'):
     if isinstance(s, unicode):
         return s.encode(enc)
-    return bytes("" if s None else s)            
+    return b'' if s is None else bytes(s)
 
 
 def touni(s, enc='utf8', err='strict'):
@@ -185,7 +252,7 @@ tonat = touni if py3k else tob                  # >> tonat的意思是to_native
 # functools.update_wrapper中有一个bug，如果wrapper是一个实例方法，会报错
 def update_wrapper(wrapper, wrapped, *a, **ka):
     try:
-        functools.update_wrapper(wrapper, wrapped, *a, **kw)
+        functools.update_wrapper(wrapper, wrapped, *a, **ka)
     except AttributeError:
         pass
 
@@ -201,7 +268,7 @@ def depr(major, minor, cause, fix):
            "Fix: %s\n" %(major, minor, cause, fix)
     if DEBUG == 'strict':                           # >> 全局常量会在文件末尾定义
         raise DeprecationWarning(text)
-    warnnings.warn(text, DeprecationWarning, stacklevel=3)
+    warnings.warn(text, DeprecationWarning, stacklevel=3)
     return DeprecationWarning(text)
 
 
@@ -226,11 +293,15 @@ class DictProperty(object):
         self.getter, self.key = func, self.key or func.__name__
         return self
 
-    def get(self, obj, cls):
-        of obj is None: return self
-        key, storage = self.key, getattr(obj, self.attr)
-        if key not in storage: storage[key] = self.getter(obj)
-        return storage[key]
+    def __get__(self, obj, cls):
+        if obj is None: return self
+        storage = getattr(obj, self.attr)
+        # 命中时只需要一次字典查找
+        try:
+            return storage[self.key]
+        except KeyError:
+            value = storage[self.key] = self.getter(obj)
+            return value
 
     def __set__(self, obj, value):
         if self.read_only: raise AttributeError("Read-Only property.")
@@ -270,6 +341,46 @@ class lazy_attribute(object):
         return value
 
 
+class SlotProperty(object):
+    """和DictProperty一样，但是把值缓存在实例的一个`__slots__`槽位中.
+
+    适用于没有`__dict__`的类，取值时不需要先通过名字找到一个字典.
+    和DictProperty一样支持只读(read_only)，删除这个属性会重置缓存的值.
+    """
+
+    def __init__(self, slot, read_only=False):
+        self.slot, self.read_only = slot, read_only
+        self.member = None      # 槽位的member描述符，第一次访问时解析
+
+    def __call__(self, func):
+        functools.update_wrapper(self, func, updated=[])
+        self.getter = func
+        return self
+
+    def _member(self, obj):
+        if self.member is None:
+            self.member = getattr(type(obj), self.slot)
+        return self.member
+
+    def __get__(self, obj, cls):
+        if obj is None: return self
+        member = self.member or self._member(obj)
+        try:
+            return member.__get__(obj, cls)
+        except AttributeError:
+            value = self.getter(obj)
+            member.__set__(obj, value)
+            return value
+
+    def __set__(self, obj, value):
+        if self.read_only: raise AttributeError("Read-Only property.")
+        self._member(obj).__set__(obj, value)
+
+    def __delete__(self, obj):
+        if self.read_only: raise AttributeError("Read-Only property.")
+        self._member(obj).__delete__(obj)
+
+
 ###############################################################################
 # Exceptions 和 Events ########################################################
 ###############################################################################
@@ -280,6 +391,34 @@ class BottleException(Exception):
     pass
 
 
+class HTTPError(BottleException):
+    """ 以一个HTTP错误响应结束请求．关键字参数是额外的响应头(比如Allow=...)
+
+    这里还没有Response对象，所以只保留upstream HTTPError的最小接口:
+    status_code, status_line, body, headers. 实例本身是一个WSGI应用,
+    中间件可以直接用它来发送错误响应．
+    """
+    default_status = 500
+
+    def __init__(self, status=None, body=None, exception=None, traceback=None, **headers):
+        self.status_code = int(status or self.default_status)
+        self.body, self.exception, self.traceback = body, exception, traceback
+        self.headers = dict((_hkey(name), str(value)) for name, value in headers.items())
+        BottleException.__init__(self, self.status_code, body)
+
+    @property
+    def status_line(self):
+        return '%d %s' % (self.status_code, httplib.responses.get(self.status_code, 'Unknown'))
+
+    def __call__(self, environ, start_response):
+        body = tob(self.body or self.status_line)
+        headers = [('Content-Type', 'text/plain; charset=UTF-8'),
+                   ('Content-Length', str(len(body)))]
+        headers += [(k, v) for k, v in self.headers.items() if k not in ('Content-Type', 'Content-Length')]
+        start_response(self.status_line, headers)
+        return [body] if environ.get('REQUEST_METHOD') != 'HEAD' else []
+
+
 ###############################################################################
 # 路由 #########################################################################
 ###############################################################################
@@ -309,8 +448,21 @@ def _re_flatten(p):
     """　将一个正则表达式模式串的捕获组转换成非捕获组 """
     if '(' not in p:
         return p
-    return re.sub(r'(\\*)(\(\?P<[^>]+>|\((?!\?))', lambda m: m.group(0), if 
-                                                    len(m.group(1)) % 2 else m.group(1) + '(?:', )
+    return re.sub(r'(\\*)(\(\?P<[^>]+>|\((?!\?))', lambda m: m.group(0) if
+                  len(m.group(1)) % 2 else m.group(1) + '(?:', p)
+
+
+class _RouteNode(object):
+    """ 基数树(radix tree)中的一个节点，对应路径规则中的一个segment """
+
+    __slots__ = ('static', 'wildcards', 'tails', 'leaf', 'first')
+
+    def __init__(self):
+        self.static = {}        # 字面量segment -> 子节点
+        self.wildcards = []     # (segment正则, match函数, 子节点)，按加入顺序排列
+        self.tails = []         # (剩余路径的match函数, 规则序号), 用于可能跨越'/'的通配符
+        self.leaf = None        # 在这个节点结束的规则序号
+        self.first = None       # 子树中最小的规则序号，用来剪枝
 
 
 class Router(object):
@@ -329,18 +481,29 @@ class Router(object):
     # 当前的CPython正则表达式不允许在一个表达式中超过99个捕获组
     _MAX_GROUPS_PER_PATTERN = 99
 
-    def __init__(self, strict=False):
+    # 这些通配符的正则不会匹配'/'，可以在基数树中按segment匹配
+    _SEGMENT_MASKS = ('[^/]+', r'-?\d+', r'-?[\d.]+')
+
+    def __init__(self, strict=False, radix=False, cache_size=0):
         self.rules = []         # 所有以顺序排列的rules
         self._groups = {}       # 在动态路由中正则找到(变量)的索引
         self.builder = {}       # url builder的数据结构
+        self._urlgen = {}       # 预编译的url builder函数，和self.builder使用相同的键
         self.static = {}        # 静态路由的搜索结构
         self.dyna_routes = {}
         self.dyna_regexes = {}  # 动态路由的搜索结构
         # 如果参数strict为True, 静态路由不会优先检查
         self.strict_order = strict
+        # 如果参数radix为True, 动态路由使用基数树按segment匹配，而不是逐个扫描合并的正则
+        self.radix = radix
+        self._trees = {}        # 动态路由的基数树，以method为键
+        # 如果cache_size大于0, 最近匹配的(method, path)结果会放入一个有界的LRU缓存
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_hits = self._cache_misses = self._cache_evictions = 0
         self.filters = {
             're': lambda conf: (_re_flatten(conf or self.default_pattern), None, None),
-            'int': labmda conf: (r'-?\d+', int, lambda x: str(int(x))),
+            'int': lambda conf: (r'-?\d+', int, lambda x: str(int(x))),
             'float': lambda conf: (r"-?[\d.]+", float, lambda x: str(float(x))),
             'path': lambda conf: (r".+?", None, None)
         }
@@ -353,6 +516,13 @@ class Router(object):
         元组的首个元素是字符串(正则), 后两个必须是可调用对象或者None.
         """
         self.filters[name] = func
+        self._cache.clear()
+
+    def cache_info(self):
+        """ 返回match()缓存的统计信息，可以用来调整cache_size """
+        return dict(hits=self._cache_hits, misses=self._cache_misses,
+                    evictions=self._cache_evictions,
+                    size=len(self._cache), maxsize=self.cache_size)
 
     rule_syntax = re.compile('(\\\\*)'
                             '(?:(?::([a-zA-Z_][a-zA-Z_0-9]*)?()(?:#(.*?)#)?)'
@@ -362,7 +532,7 @@ class Router(object):
     # >> 尴尬，看不懂这个函数是干嘛的？？？
     def _itertokens(self, rule):
         offset, prefix = 0, ''
-        for match in self.rule_sytax.finditer(rule):
+        for match in self.rule_syntax.finditer(rule):
             prefix += rule[offset:match.start()]
             g = match.groups()
             if g[2] is not None:
@@ -382,4 +552,2993 @@ class Router(object):
     
     def add(self, rule, method, target, name=None):
         """ 增加一个新的rule，或者为现存的rule替换target """
-        
\ No newline at end of file
+        self._cache.clear()     # rule集合改变了，缓存的匹配结果不再可靠
+        anons = 0       # 找到的匿名通配符数量
+        keys = []       # 键的名称
+        pattern = ''    # 包含命名组的正则表达式模式串
+        filters = []    # 通配符输入过滤器的列表
+        builder = []    # url builder的数据结构
+        is_static = True
+
+        for key, mode, conf in self._itertokens(rule):
+            if mode:
+                is_static = False
+                if mode == 'default': mode = self.default_filter
+                mask, in_filter, out_filter = self.filters[mode](conf)
+                if not key:
+                    pattern += '(?:%s)' % mask
+                    key = 'anon%d' % anons
+                    anons += 1
+                else:
+                    pattern += '(?P<%s>%s)' % (key, mask)
+                    keys.append(key)
+                if in_filter: filters.append((key, in_filter))
+                builder.append((key, out_filter or str))
+            elif key:
+                pattern += re.escape(key)
+                builder.append((None, key))
+
+        self.builder[rule] = builder
+        urlgen = self._urlgen[rule] = self._compile_builder(builder)
+        if name:
+            self.builder[name] = builder
+            self._urlgen[name] = urlgen
+
+        if is_static and not self.strict_order:
+            self.static.setdefault(method, {})
+            self.static[method][self.build(rule)] = (target, None)
+            return
+
+        try:
+            re_pattern = re.compile('^(%s)$' % pattern)
+            re_match = re_pattern.match
+        except re.error as e:
+            raise RouteSyntaxError("Could not add Route: %s (%s)" % (rule, e))
+
+        if filters:
+            def getargs(path):
+                url_args = re_match(path).groupdict()
+                for name, wildcard_filter in filters:
+                    try:
+                        url_args[name] = wildcard_filter(url_args[name])
+                    except ValueError:
+                        raise HTTPError(400, 'Path has wrong format.')
+                return url_args
+        elif re_pattern.groupindex:
+            def getargs(path):
+                return re_match(path).groupdict()
+        else:
+            getargs = None
+
+        flatpat = _re_flatten(pattern)
+        whole_rule = (rule, flatpat, target, getargs)
+
+        if (flatpat, method) in self._groups:
+            if DEBUG:
+                msg = 'Route <%s %s> overwrites a previously defined route'
+                warnings.warn(msg % (method, rule), RuntimeWarning)
+            self.dyna_routes[method][self._groups[flatpat, method]] = whole_rule
+        else:
+            self.dyna_routes.setdefault(method, []).append(whole_rule)
+            self._groups[flatpat, method] = len(self.dyna_routes[method]) - 1
+            if self.radix:
+                self._insert(method, rule, self._groups[flatpat, method])
+
+        # 基数树不需要合并的正则，省掉每次add时重新编译的开销
+        if not self.radix:
+            self._compile(method)
+
+    def _compile(self, method):
+        all_rules = self.dyna_routes[method]
+        comborules = self.dyna_regexes[method] = []
+        maxgroups = self._MAX_GROUPS_PER_PATTERN
+        for x in range(0, len(all_rules), maxgroups):
+            some = all_rules[x:x+maxgroups]
+            combined = (flatpat for (_, flatpat, _, _) in some)
+            combined = '|'.join('(^%s$)' % flatpat for flatpat in combined)
+            combined = re.compile(combined).match
+            rules = [(target, getargs) for (_, _, target, getargs) in some]
+            comborules.append((combined, rules))
+
+    def _segments(self, rule):
+        """ 把一个rule按'/'拆分成segment，返回(segments, tail)
+
+        segments中的每一项是一个(text, pattern)元组: 字面量segment的pattern为None，
+        否则pattern是匹配单个segment的正则模式串．
+        如果遇到一个可能匹配'/'的通配符(比如`path`), 从这个segment开始剩下的部分
+        会合并成一个正则模式串tail, 整体匹配剩余的路径．
+        """
+        segments, parts, text, dynamic = [], [], '', False
+        tokens = list(self._itertokens(rule))
+        for i, (key, mode, conf) in enumerate(tokens):
+            if mode:
+                if mode == 'default': mode = self.default_filter
+                mask = self.filters[mode](conf)[0]
+                if mask not in self._SEGMENT_MASKS:
+                    for key, mode, conf in tokens[i:]:
+                        if not mode:
+                            parts.append(re.escape(key))
+                            continue
+                        if mode == 'default': mode = self.default_filter
+                        parts.append('(?:%s)' % _re_flatten(self.filters[mode](conf)[0]))
+                    return segments, '^%s$' % ''.join(parts)
+                parts.append('(?:%s)' % mask)
+                dynamic = True
+                continue
+            pieces = key.split('/')
+            for piece in pieces[:-1]:
+                parts.append(re.escape(piece))
+                segments.append((None, '^%s$' % ''.join(parts)) if dynamic else (text + piece, None))
+                parts, text, dynamic = [], '', False
+            parts.append(re.escape(pieces[-1]))
+            text += pieces[-1]
+        segments.append((None, '^%s$' % ''.join(parts)) if dynamic else (text, None))
+        return segments, None
+
+    def _insert(self, method, rule, index):
+        """ 把序号为index的动态rule插入到method对应的基数树 """
+        segments, tail = self._segments(rule)
+        node = self._trees.setdefault(method, _RouteNode())
+        for text, pattern in segments:
+            if node.first is None or index < node.first: node.first = index
+            if pattern is None:
+                node = node.static.setdefault(text, _RouteNode())
+                continue
+            for other, _, child in node.wildcards:
+                if other == pattern:
+                    node = child
+                    break
+            else:
+                child = _RouteNode()
+                node.wildcards.append((pattern, re.compile(pattern).match, child))
+                node = child
+        if node.first is None or index < node.first: node.first = index
+        if tail is not None:
+            node.tails.append((re.compile(tail).match, index))
+        elif node.leaf is None or index < node.leaf:
+            node.leaf = index
+
+    def _search(self, node, segs, depth, best):
+        """ 深度优先搜索基数树，返回匹配的最小规则序号(即最先加入的rule)
+
+        子树中最小的序号如果不小于已经找到的结果，这个子树会被剪掉．
+        所以在通常情况下，匹配的时间只和路径的深度成正比．
+        """
+        if node.first is None or best is not None and node.first >= best:
+            return best
+        if node.tails:
+            rest = '/'.join(segs[depth:])
+            for tail_match, index in node.tails:
+                if (best is None or index < best) and tail_match(rest):
+                    best = index
+        if depth == len(segs):
+            if node.leaf is not None and (best is None or node.leaf < best):
+                best = node.leaf
+            return best
+        segment = segs[depth]
+        child = node.static.get(segment)
+        if child is not None:
+            best = self._search(child, segs, depth + 1, best)
+        for _, segment_match, child in node.wildcards:
+            if segment_match(segment):
+                best = self._search(child, segs, depth + 1, best)
+        return best
+
+    def _match_dynamic(self, method, path):
+        """ 在method的动态路由中查找path，返回(target, getargs)或者None """
+        if self.radix:
+            if method not in self._trees: return None
+            index = self._search(self._trees[method], path.split('/'), 0, None)
+            if index is None: return None
+            _, _, target, getargs = self.dyna_routes[method][index]
+            return target, getargs
+        for combined, rules in self.dyna_regexes.get(method, ()):
+            match = combined(path)
+            if match:
+                return rules[match.lastindex - 1]
+        return None
+
+    @staticmethod
+    def _compile_builder(builder):
+        """ 把builder列表预编译成一个函数: urlgen(args) -> url
+
+        字面量部分被合并进一个格式化字符串，只有通配符的槽位才会调用to_url过滤器．
+        args中不属于通配符的键会作为query string附加在URL后面．args本身不会被修改．
+        """
+        template = ''.join('%s' if key else part.replace('%', '%%') for key, part in builder)
+        slots = tuple((key, part) for key, part in builder if key)
+        names = frozenset(key for key, _ in slots)
+
+        def urlgen(args):
+            url = template % tuple([to_url(args[key]) for key, to_url in slots])
+            if len(args) > len(names):
+                query = [(k, v) for k, v in args.items() if k not in names]
+                if query: url += '?' + urlencode(query)
+            return url
+        return urlgen
+
+    def build(self, _name, *anons, **query):
+        """ 通过填充rule中的通配符来创建一个URL """
+        urlgen = self._urlgen.get(_name)
+        if not urlgen:
+            raise RouteBuildError("No route with that name.", _name)
+        for i, value in enumerate(anons):
+            query['anon%d' % i] = value
+        try:
+            return urlgen(query)
+        except KeyError as e:
+            raise RouteBuildError('Missing URL argument: %r' % e.args[0])
+
+    def build_many(self, _name, iterable):
+        """ 使用同一个rule批量创建URL，iterable中的每一项是一个关键字参数的字典
+
+        和多次调用build()相比，省去了每次调用的查找和**kwargs字典的复制．
+        """
+        urlgen = self._urlgen.get(_name)
+        if not urlgen:
+            raise RouteBuildError("No route with that name.", _name)
+        try:
+            return [urlgen(args) for args in iterable]
+        except KeyError as e:
+            raise RouteBuildError('Missing URL argument: %r' % e.args[0])
+
+    def match(self, environ):
+        """ 返回一个(target, url_args)元组，或者抛出HTTPError(400/404/405) """
+        verb = environ['REQUEST_METHOD'].upper()
+        path = environ['PATH_INFO'] or '/'
+
+        if not self.cache_size:
+            return self._match(verb, path)
+        key = verb, path
+        try:
+            # 先pop再插入，把这个键移到最近使用的一端(Py2的OrderedDict没有move_to_end)
+            target, url_args = self._cache[key] = self._cache.pop(key)
+            self._cache_hits += 1
+            return target, dict(url_args)
+        except KeyError:
+            pass
+        # 只缓存成功的匹配，HTTPError(400/404/405)每次都重新抛出
+        self._cache_misses += 1
+        target, url_args = self._match(verb, path)
+        self._cache[key] = target, dict(url_args)
+        while len(self._cache) > self.cache_size:
+            try:
+                self._cache.popitem(last=False)
+                self._cache_evictions += 1
+            except KeyError:
+                break
+        return target, url_args
+
+    def _match(self, verb, path):
+
+        if verb == 'HEAD':
+            methods = ['PROXY', verb, 'GET', 'ANY']
+        else:
+            methods = ['PROXY', verb, 'ANY']
+
+        for method in methods:
+            if method in self.static and path in self.static[method]:
+                target, getargs = self.static[method][path]
+                return target, getargs(path) if getargs else {}
+            found = self._match_dynamic(method, path)
+            if found:
+                target, getargs = found
+                return target, getargs(path) if getargs else {}
+
+        # 没有匹配的路由．为405响应收集可用的其它method
+        allowed = set([])
+        nocheck = set(methods)
+        for method in set(self.static) - nocheck:
+            if path in self.static[method]:
+                allowed.add(method)
+        for method in set(self.dyna_routes) - allowed - nocheck:
+            if self._match_dynamic(method, path):
+                allowed.add(method)
+        if allowed:
+            allow_header = ",".join(sorted(allowed))
+            raise HTTPError(405, "Method not allowed.", Allow=allow_header)
+
+        # 没有匹配的路由，也没有其它可用的method．放弃
+        raise HTTPError(404, "Not found: " + repr(path))
+
+
+###############################################################################
+# HTTP和WSGI工具 ################################################################
+###############################################################################
+
+
+def _parse_qsl(qs):
+    r = []
+    for pair in qs.replace(';', '&').split('&'):
+        if not pair: continue
+        nv = pair.split('=', 1)
+        if len(nv) != 2: nv.append('')
+        key = urlunquote(nv[0].replace('+', ' '))
+        value = urlunquote(nv[1].replace('+', ' '))
+        r.append((key, value))
+    return r
+
+
+def _hkey(s):
+    return s.title().replace('_', '-')
+
+
+class WSGIHeaderDict(DictMixin):
+    """ 一个类字典的对象，作为WSGI environ字典的一个只读视图(view)
+
+    不会复制environ，键在访问时才转换成environ中的'HTTP_*'形式．
+    已经解码过的值会被缓存，同一个头读多次只会解码一次．
+    """
+    #: 这些键是在CGI中定义的，不会加上'HTTP_'前缀
+    cgikeys = ('CONTENT_TYPE', 'CONTENT_LENGTH')
+
+    def __init__(self, environ):
+        self.environ = environ
+        self._values = {}
+
+    def _ekey(self, key):
+        """ 把HTTP头的名称转换为environ中的键 """
+        key = key.replace('-', '_').upper()
+        if key in self.cgikeys:
+            return key
+        return 'HTTP_' + key
+
+    def raw(self, key, default=None):
+        """ 返回没有解码的头的值 """
+        return self.environ.get(self._ekey(key), default)
+
+    def __getitem__(self, key):
+        ekey = self._ekey(key)
+        try:
+            return self._values[ekey]
+        except KeyError:
+            pass
+        val = self.environ[ekey]
+        if py3k:
+            if isinstance(val, unicode):
+                val = val.encode('latin1').decode('utf8')
+            else:
+                val = val.decode('utf8')
+        self._values[ekey] = val
+        return val
+
+    def __setitem__(self, key, value):
+        raise TypeError("%s is read-only." % self.__class__)
+
+    def __delitem__(self, key):
+        raise TypeError("%s is read-only." % self.__class__)
+
+    def __iter__(self):
+        for key in self.environ:
+            if key[:5] == 'HTTP_':
+                yield _hkey(key[5:])
+            elif key in self.cgikeys:
+                yield _hkey(key)
+
+    def keys(self):
+        return [x for x in self]
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        return self._ekey(key) in self.environ
+
+
+class LazyCookieDict(DictMixin):
+    """ Cookie请求头的一个只读、惰性解析的视图
+
+    不会一次把整个头交给SimpleCookie解析．查找一个名称时，只从上次停止的位置继续
+    向后扫描，直到找到这个名称为止，经过的cookie只记录值在头中的偏移量(offset)．
+    只读一个cookie的请求不需要解析其余的几十个．同名的cookie以第一个为准．
+    """
+
+    def __init__(self, header):
+        self._header = header or ''
+        self._pos = 0           # 下一次扫描开始的位置
+        self._index = {}        # 名称 -> 值在头中的(start, end)偏移量
+        self._values = {}       # 名称 -> 已经解码的值
+
+    def _scan(self, name=None):
+        """ 继续扫描cookie头，直到索引中出现name，或者扫描完整个头 """
+        header, pos, index = self._header, self._pos, self._index
+        size = len(header)
+        while pos < size:
+            end = header.find(';', pos)
+            if end < 0: end = size
+            eq = header.find('=', pos, end)
+            key = None
+            if eq >= 0:
+                key = header[pos:eq].strip()
+                start = eq + 1
+                while start < size and header[start] == ' ':
+                    start += 1
+                if start < size and header[start] == '"':
+                    # 带引号的值可能包含';', 要找到结束的引号
+                    q = start + 1
+                    while True:
+                        q = header.find('"', q)
+                        if q < 0 or header[q - 1] != '\\': break
+                        q += 1
+                    end = header.find(';', q) if q >= 0 else -1
+                    if end < 0: end = size
+                if key and key not in index:
+                    index[key] = (start, end)
+            pos = end + 1
+            if name is not None and key == name:
+                break
+        self._pos = pos
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        if name not in self._index:
+            self._scan(name)
+        start, end = self._index[name]
+        value = self._header[start:end].strip()
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            # 很少见的带引号的值交给SimpleCookie去处理转义
+            try:
+                value = _cookies.SimpleCookie('x=' + value)['x'].value
+            except (_cookies.CookieError, KeyError):
+                value = value[1:-1]
+        self._values[name] = value
+        return value
+
+    def __setitem__(self, key, value):
+        raise TypeError("%s is read-only." % self.__class__)
+
+    def __delitem__(self, key):
+        raise TypeError("%s is read-only." % self.__class__)
+
+    def __contains__(self, name):
+        if name not in self._index:
+            self._scan(name)
+        return name in self._index
+
+    def __iter__(self):
+        self._scan()
+        return iter(sorted(self._index, key=lambda k: self._index[k]))
+
+    def __len__(self):
+        self._scan()
+        return len(self._index)
+
+
+class EnvironCache(object):
+    """ 一个WSGI environ的紧凑包装．
+
+    常用的键(path, method, query, headers, cookies)在第一次访问时计算，然后缓存在
+    固定布局的`__slots__`槽位中．同一个请求里读几十次也只会计算一次．
+    """
+
+    __slots__ = ('environ', '_path', '_method', '_query', '_headers', '_cookies')
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    @SlotProperty('_path', read_only=True)
+    def path(self):
+        """ PATH_INFO的值，保证以'/'开头 """
+        return '/' + self.environ.get('PATH_INFO', '').lstrip('/')
+
+    @SlotProperty('_method', read_only=True)
+    def method(self):
+        """ 大写的REQUEST_METHOD """
+        return self.environ.get('REQUEST_METHOD', 'GET').upper()
+
+    @SlotProperty('_query', read_only=True)
+    def query(self):
+        """ 从QUERY_STRING解析出来的参数字典(同名的参数后面的值覆盖前面的) """
+        return dict(_parse_qsl(self.environ.get('QUERY_STRING', '')))
+
+    @SlotProperty('_headers', read_only=True)
+    def headers(self):
+        """ 请求头的只读视图(WSGIHeaderDict)，键是'Content-Type'这样的HTTP头名称 """
+        return WSGIHeaderDict(self.environ)
+
+    @SlotProperty('_cookies', read_only=True)
+    def cookies(self):
+        """ cookie名称到值的只读视图(LazyCookieDict)，cookie在第一次访问时才解析 """
+        return LazyCookieDict(self.environ.get('HTTP_COOKIE', ''))
+
+
+###############################################################################
+# 配置 #########################################################################
+###############################################################################
+# 配置值按来源分层：defaults < file < env < cli < runtime，高层覆盖低层．
+# 和collections.ChainMap不同，查找时不需要逐层寻找：某一层变化时，只为变化的键
+# 重新计算生效的值并写进字典本身，所以config['sqlite.db']就是一次普通的dict查找．
+
+
+_unset = object()
+
+
+class ConfigDict(dict):
+    """ 分层的配置字典
+
+    键是扁平的点分名称(比如'sqlite.db')．嵌套的字典和ini文件的section在载入时
+    就被展开，查找时不再逐级拆分．直接赋值(config[key] = value)写入最高的
+    'runtime'层．用add_hook()注册的回调只在键的生效值真正发生变化时才被调用,
+    重新载入一个没有改动的配置文件不会触发任何回调．
+    """
+
+    #: 按优先级从低到高排列的层
+    layers = ('defaults', 'file', 'env', 'cli', 'runtime')
+
+    def __init__(self, *a, **ka):
+        dict.__init__(self)
+        self._layers = dict((name, {}) for name in self.layers)
+        self._files = []
+        self._hooks = []
+        if a or ka:
+            self.load_dict(dict(*a, **ka))
+
+    @staticmethod
+    def _flatten(source, namespace=''):
+        """ 把嵌套的字典展开为{点分名称: 值} """
+        flat = {}
+        stack = [(namespace + '.' if namespace else '', source)]
+        while stack:
+            prefix, mapping = stack.pop()
+            for key, value in mapping.items():
+                if not isinstance(key, basestring):
+                    raise TypeError('Key has type %r (not a string)' % type(key))
+                if isinstance(value, dict):
+                    stack.append((prefix + key + '.', value))
+                else:
+                    flat[prefix + key] = value
+        return flat
+
+    def _resolve(self, key):
+        """ 从最高层往下找key的生效值 """
+        layers = self._layers
+        for name in reversed(self.layers):
+            if key in layers[name]:
+                return layers[name][key]
+        return _unset
+
+    def _apply(self, keys):
+        """ 重新计算keys的生效值，为变化了的键调用回调，返回[(key, old, new)] """
+        changed = []
+        for key in keys:
+            old, new = dict.get(self, key, _unset), self._resolve(key)
+            if new is _unset:
+                if old is _unset:
+                    continue
+                dict.__delitem__(self, key)
+            elif old is not _unset and (old is new or old == new):
+                continue
+            else:
+                dict.__setitem__(self, key, new)
+            changed.append((key, None if old is _unset else old, None if new is _unset else new))
+        for prefix, func in self._hooks if changed else ():
+            for key, old, new in changed:
+                if not prefix or key == prefix or key.startswith(prefix + '.'):
+                    func(key, old, new)
+        return changed
+
+    def add_hook(self, func, prefix=''):
+        """ 注册一个回调func(key, old, new)．prefix限定只关心某个命名空间下的键．
+            键被删除时new是None．返回func，所以也可以当作装饰器使用 """
+        self._hooks.append((prefix, func))
+        return func
+
+    def layer(self, name):
+        """ 返回某一层的一个副本 """
+        return dict(self._layers[name])
+
+    def update_layer(self, layer, source, namespace='', replace=False):
+        """ 把source展开后合并进layer，返回[(key, old, new)]
+
+            replace=True时替换整个层，原来有、现在没有的键会被删除
+        """
+        flat = self._flatten(source, namespace)
+        target = self._layers[layer]
+        keys = set(flat)
+        if replace:
+            keys.update(target)
+            target.clear()
+        target.update(flat)
+        return self._apply(keys)
+
+    def load_dict(self, source, namespace='', layer='defaults'):
+        """ 载入一个(可以嵌套的)字典:
+            {'sqlite': {'db': ':memory:'}} -> config['sqlite.db'] """
+        self.update_layer(layer, source, namespace)
+        return self
+
+    def _read_config(self, filename, options):
+        conf = configparser.ConfigParser(**options)
+        conf.read(filename)
+        flat = {}
+        for section in conf.sections():
+            for key in conf.options(section):
+                value = conf.get(section, key)
+                if section not in ('bottle', 'ROOT'):
+                    key = section + '.' + key
+                flat[key] = value
+        return flat
+
+    def load_config(self, filename, **options):
+        """ 从ini风格的配置文件载入到'file'层．[bottle]或者[ROOT] section中的键
+            放在根命名空间，其它section的名称作为命名空间．参数传给ConfigParser．
+            文件会被记住，reload()时重新读取 """
+        self._files.append((filename, options))
+        self.update_layer('file', self._read_config(filename, options))
+        return self
+
+    def reload(self):
+        """ 重新读取所有用load_config()载入过的文件，返回[(key, old, new)]，
+            只有真正变化的键会出现在结果中，回调也只为这些键调用 """
+        flat = {}
+        for filename, options in self._files:
+            flat.update(self._read_config(filename, options))
+        return self.update_layer('file', flat, replace=True)
+
+    def load_env(self, prefix='BOTTLE_', environ=None):
+        """ 从环境变量载入到'env'层: BOTTLE_SQLITE__DB=x -> config['sqlite.db'] """
+        environ = os.environ if environ is None else environ
+        flat = dict((key[len(prefix):].lower().replace('__', '.'), value)
+                    for key, value in environ.items() if key.startswith(prefix))
+        self.update_layer('env', flat, replace=True)
+        return self
+
+    def load_args(self, params):
+        """ 载入命令行的-C/--param参数(NAME=VALUE列表)到'cli'层 """
+        flat = {}
+        for param in params or ():
+            key, sep, value = param.partition('=')
+            if not sep:
+                raise ValueError('Config parameter %r is not in NAME=VALUE form.' % param)
+            flat[key.strip()] = value.strip()
+        self.update_layer('cli', flat)
+        return self
+
+    def __setitem__(self, key, value):
+        self.update_layer('runtime', {key: value})
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        for layer in self._layers.values():
+            layer.pop(key, None)
+        self._apply((key,))
+
+    def update(self, *a, **ka):
+        self.update_layer('runtime', dict(*a, **ka))
+
+    def setdefault(self, key, value=None):
+        if key not in self:
+            self[key] = value
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def clear(self):
+        for layer in self._layers.values():
+            layer.clear()
+        self._apply(list(self))
+
+
+###############################################################################
+# Multipart处理 ###############################################################
+###############################################################################
+# 代替cgi.FieldStorage: 按固定大小的块读取wsgi.input, 一边读一边解析．
+# 较小的part留在内存里，超过阈值的part写入临时文件，所以上传再大的文件，
+# 内存的峰值也只和buffer_size及阈值有关．
+
+
+class MultipartError(HTTPError):
+    """ 格式错误的multipart请求体，作为400 Bad Request响应 """
+    default_status = 400
+
+    def __init__(self, msg):
+        HTTPError.__init__(self, body="MultipartError: " + msg)
+
+
+_option_re = re.compile(r';\s*([^=;\s]+)\s*=\s*("(?:\\.|[^"])*"|[^;]*)')
+
+
+def _parse_header_options(value):
+    """ 把'form-data; name="a"'这样的头解析成('form-data', {'name': 'a'}) """
+    main, _, rest = value.partition(';')
+    options = {}
+    for key, val in _option_re.findall(';' + rest):
+        val = val.strip()
+        if len(val) > 1 and val[0] == val[-1] == '"':
+            val = val[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+        options[key.lower()] = val
+    return main.strip().lower(), options
+
+
+class _MultipartPart(object):
+    """ multipart请求体中的一个part(一个表单字段或者一个上传的文件) """
+
+    def __init__(self, header_block, charset='latin1'):
+        self.headerlist = []
+        for line in header_block.split(b'\r\n'):
+            line = line.decode(charset)
+            if ':' not in line:
+                raise MultipartError("Syntax error in header: No colon.")
+            key, value = line.split(':', 1)
+            self.headerlist.append((key.strip(), value.strip()))
+        self.headers = dict((_hkey(k), v) for k, v in self.headerlist)
+
+        self.disposition, options = _parse_header_options(self.headers.get('Content-Disposition', ''))
+        if not self.disposition:
+            raise MultipartError("Content-Disposition header is missing.")
+        self.name = options.get('name')
+        self.filename = options.get('filename')
+        self.content_type, options = _parse_header_options(self.headers.get('Content-Type', ''))
+        self.charset = options.get('charset') or charset
+
+        self.file = BytesIO()
+        self.size = 0
+        self.in_memory = True
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def spill(self):
+        """ 把内存中的内容转移到一个临时文件，之后的write()直接写入文件 """
+        tmp = tempfile.TemporaryFile(mode='w+b')
+        tmp.write(self.file.getvalue())
+        self.file, self.in_memory = tmp, False
+
+    def finish(self):
+        self.file.seek(0)
+
+    @property
+    def raw(self):
+        """ part的内容(bytes). 对于写入临时文件的大part，这会把整个文件读入内存 """
+        pos = self.file.tell()
+        self.file.seek(0)
+        try:
+            return self.file.read()
+        finally:
+            self.file.seek(pos)
+
+    @property
+    def value(self):
+        """ 用part的字符集解码后的内容 """
+        return self.raw.decode(self.charset)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = False
+
+
+class _MultipartParser(object):
+    #: 一个part的所有头加起来的最大字节数
+    header_limit = 2 ** 13
+
+    def __init__(self, stream, boundary, content_length=-1,
+                 disk_limit=2 ** 30, mem_limit=2 ** 20, memfile_limit=2 ** 18,
+                 buffer_size=2 ** 16, charset='latin1'):
+        """ 一个流式的multipart/form-data解析器
+
+        参数:
+            stream: 可读的请求体，通常是environ['wsgi.input']
+            boundary: Content-Type头中的boundary参数
+            content_length: 请求体的长度，-1表示未知(读到流结束)
+            disk_limit: 所有part加起来的最大字节数
+            mem_limit: 所有留在内存中的part加起来的最大字节数
+            memfile_limit: 单个part超过这个大小就写入临时文件
+            buffer_size: 每次从stream读取的块大小
+        """
+        self.stream = stream
+        self.boundary = boundary
+        self.content_length = content_length
+        self.disk_limit = disk_limit
+        self.memfile_limit = memfile_limit
+        self.mem_limit = min(mem_limit, disk_limit)
+        self.buffer_size = min(buffer_size, mem_limit)
+        self.charset = charset
+        if not boundary:
+            raise MultipartError("No boundary.")
+        if self.buffer_size - 6 < len(boundary):
+            raise MultipartError("Boundary does not fit into buffer_size.")
+
+    def _iterchunks(self):
+        read, remaining = self.stream.read, self.content_length
+        bufsize = self.buffer_size
+        while remaining != 0:
+            chunk = read(bufsize if remaining < 0 else min(bufsize, remaining))
+            if not chunk:
+                break
+            if remaining > 0:
+                remaining -= len(chunk)
+            yield chunk
+
+    def parse(self):
+        """ 一个生成器，每解析完一个part就yield一个_MultipartPart """
+        boundary = tob(self.boundary, self.charset)
+        first, delim = b'--' + boundary, b'\r\n--' + boundary
+        keep = len(delim) - 1       # 缓冲区末尾可能是半个分隔符，要保留这么多字节
+        chunks = self._iterchunks()
+        mem_used = disk_used = 0
+
+        def more(buf):
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise MultipartError("Unexpected end of input.")
+            return buf + chunk
+
+        # 跳过第一个分隔符之前的前言(preamble)
+        buf = b''
+        while True:
+            i = buf.find(first)
+            if i >= 0:
+                buf = buf[i + len(first):]
+                break
+            buf = more(buf[-len(first):])
+
+        while True:
+            while len(buf) < 2:
+                buf = more(buf)
+            if buf[:2] == b'--':
+                return      # 结束的分隔符，之后的epilogue被忽略
+            if buf[:2] != b'\r\n':
+                raise MultipartError("Unexpected data after boundary.")
+            buf = buf[2:]
+
+            # part的头，以一个空行结束
+            while True:
+                i = buf.find(b'\r\n\r\n')
+                if i >= 0 or buf[:2] == b'\r\n':
+                    break
+                if len(buf) > self.header_limit:
+                    raise MultipartError("Part header too long.")
+                buf = more(buf)
+            if i < 0 or buf[:2] == b'\r\n':
+                raise MultipartError("Content-Disposition header is missing.")
+            part = _MultipartPart(buf[:i], self.charset)
+            buf = buf[i + 4:]
+
+            # part的内容，直到下一个分隔符
+            while True:
+                i = buf.find(delim)
+                if i >= 0:
+                    data, buf = buf[:i], buf[i + len(delim):]
+                elif len(buf) > keep:
+                    data, buf = buf[:-keep], buf[-keep:]
+                else:
+                    data = b''
+                if data:
+                    part.write(data)
+                    if part.in_memory and (part.size > self.memfile_limit or
+                                           mem_used + part.size > self.mem_limit):
+                        part.spill()
+                    if disk_used + mem_used + part.size > self.disk_limit:
+                        raise MultipartError("Request too big. Increase disk_limit.")
+                if i >= 0:
+                    break
+                buf = more(buf)
+
+            part.finish()
+            if part.in_memory:
+                mem_used += part.size
+            else:
+                disk_used += part.size
+            yield part
+
+
+def parse_multipart(environ, **options):
+    """ 流式地解析一个multipart/form-data请求，返回一个生成器，每完成一个字段yield一次
+
+    options会传给_MultipartParser(比如memfile_limit, buffer_size).
+    """
+    ctype, params = _parse_header_options(environ.get('CONTENT_TYPE', ''))
+    if ctype != 'multipart/form-data':
+        raise MultipartError("Not a multipart/form-data request.")
+    clen = int(environ.get('CONTENT_LENGTH') or -1)
+    parser = _MultipartParser(environ['wsgi.input'], params.get('boundary', ''), clen, **options)
+    return parser.parse()
+
+
+###############################################################################
+# JSON编解码 ###################################################################
+###############################################################################
+# 模块头部在import时选定了json_dumps/json_lds. 这里提供一个可选择的codec注册表,
+# 应用(插件参数)和路由(route.config['json.codec'])都可以指定一个优先的codec链．
+
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+class JSONCodec(object):
+    """ 一对JSON编码/解码函数．encode()总是返回bytes，可以直接作为WSGI响应体 """
+
+    def __init__(self, name, dumps, loads, binary=False):
+        self.name, self.dumps, self.loads = name, dumps, loads
+        self.binary = binary    # dumps()是否已经返回bytes(比如orjson)
+
+    def encode(self, obj):
+        data = self.dumps(obj)
+        return data if self.binary else tob(data)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
+
+
+def _orjson_codec():
+    import orjson
+    return JSONCodec('orjson', orjson.dumps, orjson.loads, binary=True)
+
+
+def _ujson_codec():
+    import ujson
+    return JSONCodec('ujson', ujson.dumps, ujson.loads)
+
+
+def _stdlib_json_codec():
+    import json
+    # 和orjson/ujson的输出保持一致：不在分隔符后面加空格
+    dumps = functools.partial(json.dumps, separators=(',', ':'))
+    return JSONCodec('json', dumps, json.loads)
+
+
+#: codec名称 -> JSONCodec，或者第一次使用时才import的工厂函数．None表示无法import
+json_codecs = {'orjson': _orjson_codec, 'ujson': _ujson_codec, 'json': _stdlib_json_codec}
+
+#: 默认的codec链，按顺序使用第一个可以import的codec
+json_codec_chain = ('orjson', 'ujson', 'json')
+
+
+def register_json_codec(name, dumps, loads, binary=False):
+    """ 注册一个自定义的JSON codec，之后可以通过名称选择它 """
+    codec = json_codecs[name] = JSONCodec(name, dumps, loads, binary)
+    return codec
+
+
+def get_json_codec(*names):
+    """ 返回names(默认是json_codec_chain)中第一个可用的JSONCodec """
+    for name in names or json_codec_chain:
+        codec = json_codecs.get(name)
+        if codec is not None and not isinstance(codec, JSONCodec):
+            try:
+                codec = json_codecs[name] = codec()
+            except ImportError:
+                codec = json_codecs[name] = None
+        if codec is not None:
+            return codec
+    raise BottleException("No JSON codec available: %s" % ', '.join(names or json_codec_chain))
+
+
+class JSONStream(object):
+    """ 由回调函数返回，告诉JSONPlugin把一个(可能很大的)序列当作JSON数组分块输出
+
+    这样不需要先在内存中拼出一个巨大的字符串．items可以是任何可迭代对象，包括生成器．
+    """
+
+    def __init__(self, items, chunk_size=None):
+        self.items, self.chunk_size = items, chunk_size
+
+
+def _iter_json_array(codec, items, chunk_size, environ=None):
+    """ 把items编码为一个JSON数组，每chunk_size个元素yield一次 """
+    encode, items = codec.encode, iter(items)
+    yield b'['
+    sep = b''
+    while True:
+        start = _timer()
+        chunk = b','.join([encode(item) for item in itertools.islice(items, chunk_size)])
+        if environ is not None:
+            environ['bottle.json.time'] = environ.get('bottle.json.time', 0.0) + _timer() - start
+        if not chunk:
+            break
+        yield sep + chunk
+        sep = b','
+    yield b']'
+
+
+class JSONResponse(object):
+    """ 一个JSON响应(WSGI应用)，和HTTPError一样可以直接交给服务器或中间件
+
+    这里还没有request/response对象，所以序列化推迟到以WSGI应用的方式调用时进行，
+    花费的时间(秒)累加到environ['bottle.json.time']．obj是JSONStream时分块输出,
+    不设置Content-Length．
+    """
+
+    def __init__(self, obj, codec, status=200, headers=None, chunk_size=100):
+        self.obj, self.codec, self.status_code = obj, codec, int(status)
+        self.headers = dict(headers or ())
+        self.chunk_size = chunk_size
+
+    @property
+    def status_line(self):
+        return '%d %s' % (self.status_code, httplib.responses.get(self.status_code, 'Unknown'))
+
+    def __call__(self, environ, start_response):
+        headers = [('Content-Type', 'application/json')]
+        headers += [(k, v) for k, v in self.headers.items() if k not in ('Content-Type', 'Content-Length')]
+        if isinstance(self.obj, JSONStream):
+            start_response(self.status_line, headers)
+            if environ.get('REQUEST_METHOD') == 'HEAD':
+                return []
+            return _iter_json_array(self.codec, self.obj.items,
+                                    self.obj.chunk_size or self.chunk_size, environ)
+        start = _timer()
+        body = self.codec.encode(self.obj)
+        environ['bottle.json.time'] = environ.get('bottle.json.time', 0.0) + _timer() - start
+        headers.append(('Content-Length', str(len(body))))
+        start_response(self.status_line, headers)
+        return [body] if environ.get('REQUEST_METHOD') != 'HEAD' else []
+
+
+class JSONPlugin(object):
+    name = 'json'
+    api = 2
+
+    def __init__(self, codec=json_codec_chain, chunk_size=100):
+        """ 把返回dict的回调函数的结果编码为JSON
+
+        参数:
+            codec: codec名称，或者按优先顺序排列的codec名称链．
+                   单个路由可以通过route.config['json.codec']覆盖．
+            chunk_size: 回调函数返回JSONStream时，每块包含的元素数量．
+
+        回调函数返回dict或者JSONStream(或者抛出body是dict的HTTPError)时，包装后的
+        回调函数返回一个JSONResponse; 其它返回值原样通过．
+        每个请求花在序列化上的时间(秒)记录在environ['bottle.json.time']．
+        """
+        self.codec, self.chunk_size = codec, chunk_size
+
+    def apply(self, callback, route):
+        names = getattr(route, 'config', {}).get('json.codec', self.codec)
+        if not names:
+            return callback
+        codec = get_json_codec(*makelist(names))
+        chunk_size = self.chunk_size
+
+        def wrapper(*a, **ka):
+            try:
+                rv = callback(*a, **ka)
+            except HTTPError as e:
+                rv = e
+
+            if isinstance(rv, (dict, JSONStream)):
+                return JSONResponse(rv, codec, chunk_size=chunk_size)
+            elif isinstance(rv, HTTPError) and isinstance(rv.body, dict):
+                return JSONResponse(rv.body, codec, rv.status_code, rv.headers, chunk_size)
+            return rv
+
+        return wrapper
+
+
+###############################################################################
+# 签名cookie ###################################################################
+###############################################################################
+
+
+class SignedCookieCodec(object):
+    """ 带HMAC签名的cookie值，格式和旧的cookie_encode()一样是`!<签名>?<数据>`,
+        两部分都是base64．
+
+    数据是紧凑的JSON `[name, value]`：签名覆盖了cookie的名称，一个cookie的值不能被
+    挪到另一个名称下使用．和pickle不同，解码不会执行任何代码，值只能是JSON能表示的
+    类型．HMAC对象在构造时用secret初始化一次，之后每次签名/验证只copy()它，
+    不需要再处理key．
+    """
+
+    def __init__(self, secret, digestmod='sha256', codec=json_codec_chain):
+        self._hmac = hmac.new(tob(secret), digestmod=digestmod)
+        self.codec = codec if isinstance(codec, JSONCodec) else get_json_codec(*makelist(codec))
+
+    def _sign(self, msg):
+        mac = self._hmac.copy()
+        mac.update(msg)
+        return mac.digest()
+
+    @staticmethod
+    def is_encoded(data):
+        if data is None:
+            return False
+        data = tob(data)
+        return data[:1] == b'!' and b'?' in data
+
+    def encode(self, name, value):
+        """ 返回可以直接作为cookie值的字符串 """
+        msg = binascii.b2a_base64(self.codec.encode([name, value]))[:-1]
+        sig = binascii.b2a_base64(self._sign(msg))[:-1]
+        return touni(b'!' + sig + b'?' + msg)
+
+    def _iter_decoded(self, items):
+        """ 对(name, 原始值)逐个验证解码，只yield验证通过的(name, value) """
+        sign, compare, loads = self._sign, hmac.compare_digest, self.codec.loads
+        a2b = binascii.a2b_base64
+        for name, data in items:
+            if data is None:
+                continue
+            data = tob(data)
+            if data[:1] != b'!':
+                continue
+            sig, _, msg = data[1:].partition(b'?')
+            try:
+                if not msg or not compare(a2b(sig), sign(msg)):
+                    continue
+                payload = loads(touni(a2b(msg)))
+            except (TypeError, ValueError):     # binascii.Error是ValueError的子类
+                continue
+            if isinstance(payload, list) and len(payload) == 2 and payload[0] == name:
+                yield name, payload[1]
+
+    def decode(self, name, data, default=None):
+        """ 验证并解码一个cookie值．签名不正确或者无法解码时返回default """
+        for _, value in self._iter_decoded(((name, data),)):
+            return value
+        return default
+
+    def decode_many(self, cookies, names=None):
+        """ 一次验证、解码多个cookie
+
+        cookies是名称 -> 原始值的映射(比如EnvironCache.cookies)，names限定只处理
+        其中的一部分．返回名称 -> 值的dict, 没有签名、签名错误或者解码失败的cookie
+        不会出现在结果中．
+        """
+        if names is None:
+            items = cookies.items()
+        else:
+            items = ((name, cookies[name]) for name in names if name in cookies)
+        return dict(self._iter_decoded(items))
+
+
+###############################################################################
+# 服务器适配器 ##################################################################
+###############################################################################
+
+
+class ServerAdapter(object):
+    quiet = False
+
+    def __init__(self, host='127.0.0.1', port=8080, **options):
+        self.options = options
+        self.host = host
+        self.port = int(port)
+
+    def run(self, handler):  # pragma: no cover
+        pass
+
+    def __repr__(self):
+        args = ', '.join(['%s=%s' % (k, repr(v)) for k, v in self.options.items()])
+        return "%s(%s)" % (self.__class__.__name__, args)
+
+
+class WSGIRefServer(ServerAdapter):
+    """ 标准库wsgiref的单进程、单线程服务器，命令行默认使用它 """
+
+    def run(self, handler):  # pragma: no cover
+        from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+        options = dict(self.options)
+        if self.quiet:
+            class QuietHandler(WSGIRequestHandler):
+                def log_request(*args, **kw):
+                    pass
+            options['handler_class'] = QuietHandler
+
+        self.srv = make_server(self.host, self.port, handler, **options)
+        self.port = self.srv.server_port    # 当port为0时，这是系统分配的端口
+        try:
+            self.srv.serve_forever()
+        finally:
+            self.srv.server_close()
+
+
+class PreforkServer(ServerAdapter):
+    """ 一个只依赖标准库的pre-fork服务器(只能用于POSIX系统)
+
+    主进程只绑定一次socket，然后fork出`workers`个子进程(默认是CPU的数量)，
+    它们在同一个socket上accept连接．主进程负责:
+
+        * 子进程意外退出时重新启动一个新的
+        * 收到SIGHUP时平滑重启: 先启动一组新的子进程，再让旧的子进程处理完当前
+          的请求后退出
+        * 收到SIGINT/SIGTERM时让所有子进程处理完当前的请求后退出
+
+    因为应用在fork之前已经加载，SIGHUP不会重新加载代码(那是--reload的工作)．
+    """
+
+    #: 子进程多久检查一次是否需要退出(秒)
+    poll_interval = 0.5
+
+    def run(self, handler):  # pragma: no cover
+        import signal
+        from multiprocessing import cpu_count
+        from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("The prefork server requires os.fork().")
+
+        options = dict(self.options)
+        workers = int(options.pop('workers', None) or cpu_count())
+        if self.quiet:
+            class QuietHandler(WSGIRequestHandler):
+                def log_request(*args, **kw):
+                    pass
+            options['handler_class'] = QuietHandler
+
+        self.srv = make_server(self.host, self.port, handler, **options)
+        self.port = self.srv.server_port    # 当port为0时，这是系统分配的端口
+        self.children = {}                  # pid -> 这个子进程所属的代(generation)
+        self.generation = 0
+        self.running = True
+
+        def reload(signum, frame):
+            self.generation += 1
+
+        def stop(signum, frame):
+            self.running = False
+
+        signal.signal(signal.SIGHUP, reload)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            while self.running:
+                self._reap()
+                self._manage(workers)
+                time.sleep(self.poll_interval / 2)
+        finally:
+            self._stop_all()
+            self.srv.server_close()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = self.generation
+            return pid
+        # 子进程: 处理请求直到被要求退出，永远不会返回到主进程的循环
+        import signal
+        status = 1
+        try:
+            alive = [True]
+
+            def stop(signum, frame):
+                alive[0] = False
+
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, stop)
+            signal.signal(signal.SIGTERM, stop)
+            self.srv.timeout = self.poll_interval
+            while alive[0]:
+                self.srv.handle_request()
+            status = 0
+        except BaseException:
+            print_exc()
+        finally:
+            os._exit(status)
+
+    def _reap(self):
+        """ 回收已经退出的子进程 """
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                break
+            if not pid:
+                break
+            self.children.pop(pid, None)
+
+    def _manage(self, workers):
+        """ 把当前代的子进程补足到workers个，并让旧代的子进程退出 """
+        import signal
+        current = [pid for pid, gen in self.children.items() if gen == self.generation]
+        for _ in range(workers - len(current)):
+            self._spawn()
+        for pid, gen in list(self.children.items()):
+            if gen is not None and gen != self.generation:
+                self._kill(pid, signal.SIGTERM)
+                self.children[pid] = None   # 已经通知过，等待它退出
+
+    def _kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            self.children.pop(pid, None)
+
+    def _stop_all(self, timeout=10.0):
+        import signal
+        for pid in list(self.children):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.time() + timeout
+        while self.children and time.time() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self.children):
+            self._kill(pid, signal.SIGKILL)
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except OSError:
+                break
+            self.children.pop(pid, None)
+
+
+class _BoundedThreadPool(object):
+    """ 一个固定大小的线程池，任务队列是有界的
+
+    队列满的时候submit()会阻塞，调用者(accept循环)因此会停下来，
+    新的连接留在内核的backlog中，这就是对accept循环的背压(backpressure)．
+    """
+
+    def __init__(self, workers, queue_size):
+        try:
+            from queue import Queue
+        except ImportError:
+            from Queue import Queue
+        self.workers = workers
+        self.queue = Queue(maxsize=queue_size)
+        self.active = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        for _ in range(workers):
+            t = threading.Thread(target=self._run)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, func, *args):
+        self.queue.put((func, args))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            func, args = item
+            with self._lock:
+                self.active += 1
+            try:
+                func(*args)
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+    def stats(self):
+        """ 线程池的仪表(gauge): 线程数，正在工作的线程数，排队的连接数 """
+        return {'workers': self.workers, 'active': self.active,
+                'queued': self.queue.qsize(), 'queue_size': self.queue.maxsize}
+
+    def shutdown(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for t in self._threads:
+            t.join()
+
+
+class _LimitedInput(object):
+    """ 把请求体限制在Content-Length以内，这样同一个连接上的下一个请求不会被读走 """
+
+    def __init__(self, stream, length):
+        self.stream, self.remaining = stream, length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.readline(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def drain(self):
+        """ 丢掉应用没有读完的请求体 """
+        while self.remaining and self.read(2 ** 16):
+            pass
+
+
+class ThreadedServer(ServerAdapter):
+    """ 一个只依赖标准库的多线程服务器，支持HTTP/1.1 keep-alive和pipelining
+
+    连接被分发到一个固定大小的线程池(选项`workers`, 默认10)．池子饱和时最多
+    有`queue_size`个连接排队，之后accept循环会阻塞(背压)．空闲的keep-alive
+    连接在`keepalive`秒后关闭；有其它连接在排队时，请求处理完就关闭连接，
+    把线程让出来．
+
+    应用可以通过environ['bottle.threadpool'].stats()读取队列深度和工作线程数．
+    """
+
+    def run(self, handler):  # pragma: no cover
+        from wsgiref.simple_server import make_server, WSGIRequestHandler, ServerHandler
+
+        options = dict(self.options)
+        workers = int(options.pop('workers', None) or 10)
+        queue_size = int(options.pop('queue_size', None) or workers * 2)
+        keepalive = float(options.pop('keepalive', 5))
+        pool = self.pool = _BoundedThreadPool(workers, queue_size)
+        quiet = self.quiet
+
+        class KeepAliveServerHandler(ServerHandler):
+            def cleanup_headers(self):
+                ServerHandler.cleanup_headers(self)
+                rh = self.request_handler
+                bodyless = self.status[:1] == '1' or self.status[:3] in ('204', '304')
+                if 'Content-Length' not in self.headers and not bodyless:
+                    # 没有长度的响应体只能靠关闭连接来结束
+                    rh.close_connection = True
+                if rh.close_connection:
+                    self.headers['Connection'] = 'close'
+                elif self.http_version == '1.0':
+                    self.headers['Connection'] = 'keep-alive'
+
+            def sendfile(self):
+                # wsgi.file_wrapper包装的文件通过socket.sendfile()零拷贝地发送
+                filelike = getattr(self.result, 'filelike', None)
+                length = self.headers.get('Content-Length')
+                if not hasattr(os, 'sendfile') or length is None or not hasattr(filelike, 'fileno'):
+                    return False
+                if not self.headers_sent:
+                    self.send_headers()
+                conn = self.request_handler.connection
+                self.bytes_sent = conn.sendfile(filelike, filelike.tell(), int(length))
+                return True
+
+        class KeepAliveHandler(WSGIRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            timeout = keepalive
+
+            def handle(self):
+                self.close_connection = True
+                self.handle_one_request()
+                while not self.close_connection:
+                    self.handle_one_request()
+
+            def handle_one_request(self):
+                try:
+                    self.raw_requestline = self.rfile.readline(65537)
+                except (socket.timeout, OSError):
+                    self.close_connection = True
+                    return
+                if not self.raw_requestline:
+                    self.close_connection = True
+                    return
+                if len(self.raw_requestline) > 65536:
+                    self.requestline = self.request_version = self.command = ''
+                    self.send_error(414)
+                    self.close_connection = True
+                    return
+                if not self.parse_request():
+                    return
+                if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+                    # 不支持chunked请求体，读完这个请求就关闭连接
+                    stdin = self.rfile
+                    self.close_connection = True
+                else:
+                    length = self.headers.get('Content-Length', '')
+                    stdin = _LimitedInput(self.rfile, int(length) if length.isdigit() else 0)
+                if pool.queue.qsize():
+                    self.close_connection = True    # 有连接在排队，不要占着线程
+                sh = KeepAliveServerHandler(stdin, self.wfile, self.get_stderr(),
+                                            self.get_environ(), multithread=True)
+                sh.http_version = '1.1' if self.request_version >= 'HTTP/1.1' else '1.0'
+                sh.request_handler = self
+                sh.run(self.server.get_app())
+                if isinstance(stdin, _LimitedInput) and not self.close_connection:
+                    stdin.drain()
+
+            def get_environ(self):
+                environ = WSGIRequestHandler.get_environ(self)
+                environ['bottle.threadpool'] = pool
+                return environ
+
+            def log_request(self, *args, **kw):
+                if not quiet:
+                    return WSGIRequestHandler.log_request(self, *args, **kw)
+
+        srv = make_server(self.host, self.port, handler, handler_class=KeepAliveHandler, **options)
+        self.port = srv.server_port
+
+        def process_request(request, client_address):
+            pool.submit(process_request_thread, request, client_address)
+
+        def process_request_thread(request, client_address):
+            try:
+                srv.finish_request(request, client_address)
+            except Exception:
+                srv.handle_error(request, client_address)
+            finally:
+                srv.shutdown_request(request)
+
+        srv.process_request = process_request
+        self.srv = srv
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            srv.server_close()
+            pool.shutdown()
+
+
+class _StreamInput(object):
+    """ AsyncioServer的wsgi.input: 按需从连接的StreamReader读取请求体，不超过Content-Length
+
+    请求体不会先整个读进内存．在线程池中运行的应用照常调用read()/readline(),
+    读取在事件循环上进行；直接在事件循环中运行的`async def`应用使用
+    `await aread()`/`await areadline()`．
+    """
+
+    bufsize = 2 ** 16
+
+    def __init__(self, reader, loop, length):
+        self.reader, self.loop, self.remaining = reader, loop, length
+        self.buf = bytearray()      # 已经从连接读出、还没交给应用的数据
+        self.unread = length        # 还没有从连接读出的字节数
+        self.loop_thread = threading.current_thread()
+
+    async def _fill(self, size):
+        size = min(size, self.unread)
+        data = await self.reader.read(size) if size else b''
+        self.unread = self.unread - len(data) if data else 0    # 连接提前关闭时当作结束
+        self.buf += data
+        return data
+
+    async def aread(self, size=-1):
+        if size is None or size < 0:
+            size = self.remaining
+        while len(self.buf) < size and await self._fill(max(size - len(self.buf), self.bufsize)):
+            pass
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        self.remaining -= len(data)
+        return data
+
+    async def areadline(self, size=-1):
+        size = -1 if size is None else size
+        while b'\n' not in self.buf and not 0 <= size <= len(self.buf) \
+                and await self._fill(self.bufsize):
+            pass
+        end = self.buf.find(b'\n') + 1 or len(self.buf)
+        if 0 <= size < end:
+            end = size
+        data = bytes(self.buf[:end])
+        del self.buf[:end]
+        self.remaining -= len(data)
+        return data
+
+    async def adrain(self):
+        """ 丢掉应用没有读完的请求体 """
+        while self.remaining and await self.aread(self.bufsize):
+            pass
+
+    def _wait(self, coro):
+        if threading.current_thread() is self.loop_thread:
+            coro.close()
+            raise RuntimeError("Use 'await wsgi.input.aread()' in async handlers.")
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def read(self, size=-1):
+        return self._wait(self.aread(size))
+
+    def readline(self, size=-1):
+        return self._wait(self.areadline(size))
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+class AsyncioServer(ServerAdapter):
+    """ 基于asyncio的服务器，连接的读写都在事件循环中进行
+
+    空闲的keep-alive连接不占用线程，一个进程可以保持上万个空闲连接．
+    普通的(同步的)WSGI应用在一个线程池(选项`workers`)中运行，响应体如果不是
+    list/tuple，每一块也在线程池中取出，不会阻塞事件循环．如果handler本身是一个
+    `async def handler(environ, start_response)`，它直接在事件循环中被await．
+    同步的应用返回一个awaitable(比如`async def`回调函数返回的协程)时，它也在事件
+    循环中被await，结果作为响应体．响应体也可以是一个异步迭代器．
+    请求体不会预先读进内存: wsgi.input(_StreamInput)在应用读取时才从连接读取．
+    """
+
+    #: keep-alive连接空闲多久后关闭(秒)
+    keepalive = 75
+    #: 请求行加上所有头的最大字节数
+    header_limit = 2 ** 16
+
+    def run(self, handler):  # pragma: no cover
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        from wsgiref.util import FileWrapper
+        self.file_wrapper = FileWrapper
+
+        options = dict(self.options)
+        self.keepalive = float(options.pop('keepalive', self.keepalive))
+        executor = ThreadPoolExecutor(max_workers=options.pop('workers', None))
+        loop = self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        async def serve(reader, writer):
+            try:
+                while await self._handle(loop, executor, handler, reader, writer):
+                    pass
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError):
+                pass
+            finally:
+                writer.close()
+
+        srv = loop.run_until_complete(asyncio.start_server(
+            serve, self.host, self.port, backlog=options.pop('backlog', 2048), **options))
+        self.port = srv.sockets[0].getsockname()[1]
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            srv.close()
+            loop.run_until_complete(srv.wait_closed())
+            executor.shutdown(wait=False)
+            loop.close()
+
+    def _environ(self, method, target, version, headers, stdin, writer):
+        path, _, query = target.partition('?')
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urlunquote(path),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': stdin,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'asyncio.loop': self.loop,
+            'wsgi.file_wrapper': self.file_wrapper,
+        }
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+            else:
+                key = 'HTTP_' + key
+                environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
+
+    def _head(self, version, status, headerlist):
+        """ 响应的状态行和头 """
+        out = ['%s %s\r\n' % (version if version in ('HTTP/1.0', 'HTTP/1.1') else 'HTTP/1.1', status)]
+        out.extend('%s: %s\r\n' % (k, v) for k, v in headerlist)
+        return tob(''.join(out) + '\r\n', 'latin1')
+
+    async def _handle(self, loop, executor, handler, reader, writer):
+        """ 处理连接上的一个请求，返回连接是否可以继续使用(keep-alive) """
+        import asyncio
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive)
+        if len(head) > self.header_limit:
+            writer.write(b'HTTP/1.1 431 Request Header Fields Too Large\r\nConnection: close\r\n\r\n')
+            return False
+        lines = head.decode('latin1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n')
+            return False
+        headers = [line.split(':', 1) for line in lines[1:] if ':' in line]
+        headers = [(k.strip(), v.strip()) for k, v in headers]
+        hdict = dict((k.lower(), v) for k, v in headers)
+
+        if 'chunked' in hdict.get('transfer-encoding', '').lower():
+            writer.write(b'HTTP/1.1 411 Length Required\r\nConnection: close\r\n\r\n')
+            return False
+        if hdict.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        length = hdict.get('content-length', '0')
+        stdin = _StreamInput(reader, loop, int(length) if length.isdigit() else 0)
+
+        connection = hdict.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        environ = self._environ(method, target, version, headers, stdin, writer)
+        response = []       # [status, headerlist]
+
+        def start_response(status, headerlist, exc_info=None):
+            if exc_info and response and response[0] is None:
+                _raise(*exc_info)       # 头已经发送，不能再修改
+            response[:] = [status, list(headerlist)]
+            return lambda data: writer.write(data)
+
+        if asyncio.iscoroutinefunction(handler):
+            result = await handler(environ, start_response)
+        else:
+            result = await loop.run_in_executor(executor, handler, environ, start_response)
+        if hasattr(result, '__await__'):
+            # 比如bottle应用的async def回调函数返回的协程: 在事件循环中await,
+            # 不占用线程池里的线程．协程可以抛出HTTPError结束请求
+            try:
+                result = await result
+            except HTTPError as e:
+                result = e(environ, start_response)
+
+        filelike = getattr(result, 'filelike', None)
+        if response and hasattr(filelike, 'fileno'):
+            status, headerlist = response
+            length = [v for k, v in headerlist if k.lower() == 'content-length']
+            if length:
+                # wsgi.file_wrapper包装的文件通过loop.sendfile()零拷贝地发送
+                try:
+                    headerlist.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+                    writer.write(self._head(version, status, headerlist))
+                    if method != 'HEAD' and int(length[0]):
+                        await loop.sendfile(writer.transport, filelike, filelike.tell(), int(length[0]))
+                    await writer.drain()
+                finally:
+                    result.close()
+                if keep_alive:
+                    await stdin.adrain()
+                return keep_alive
+
+        done = object()
+        if hasattr(result, '__aiter__'):
+            chunks = result.__aiter__()
+            async def next_chunk():
+                try:
+                    return await chunks.__anext__()
+                except StopAsyncIteration:
+                    return done
+        elif isinstance(result, (list, tuple)):
+            chunks = iter(result)
+            async def next_chunk():
+                return next(chunks, done)
+        else:
+            chunks = iter(result)
+            async def next_chunk():
+                return await loop.run_in_executor(executor, next, chunks, done)
+
+        try:
+            # 在第一块数据产生之后才发送头，应用可能在生成器中调用start_response
+            first = await next_chunk()
+            status, headerlist = response
+            names = set(k.lower() for k, _ in headerlist)
+            chunked = False
+            if 'content-length' not in names:
+                if first is done or isinstance(result, (list, tuple)) and len(result) == 1:
+                    headerlist.append(('Content-Length', str(0 if first is done else len(first))))
+                elif version == 'HTTP/1.1':
+                    headerlist.append(('Transfer-Encoding', 'chunked'))
+                    chunked = True
+                else:
+                    keep_alive = False
+            headerlist.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+            writer.write(self._head(version, status, headerlist))
+            response[0] = None
+            chunk = first
+            while chunk is not done:
+                if chunk and method != 'HEAD':
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    await writer.drain()
+                chunk = await next_chunk()
+            if chunked and method != 'HEAD':
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        if keep_alive:
+            # 应用没有读完的请求体要丢掉，连接上的下一个请求才能被正确解析
+            await stdin.adrain()
+        return keep_alive
+
+
+class AsyncPlugin(object):
+    """ 让其它服务器也能使用`async def`的回调函数: 每个请求在一个新的事件循环中运行协程
+
+    AsyncioServer不需要这个插件，它直接在自己的事件循环中await应用返回的协程．
+    """
+    name = 'async'
+    api = 2
+
+    def apply(self, callback, route):
+        import asyncio
+        if not asyncio.iscoroutinefunction(callback):
+            return callback
+
+        def wrapper(*a, **ka):
+            return asyncio.run(callback(*a, **ka))
+
+        return wrapper
+
+
+server_names = {
+    'wsgiref': WSGIRefServer,
+    'prefork': PreforkServer,
+    'threaded': ThreadedServer,
+    'asyncio': AsyncioServer,
+}
+
+
+###############################################################################
+# 应用控制 #####################################################################
+###############################################################################
+
+
+def _module_files():
+    """ 返回所有已经import的模块的源文件路径 """
+    files = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', '') or ''
+        if path[-4:] in ('.pyo', '.pyc'): path = path[:-1]
+        if path and os.path.exists(path): files.add(os.path.abspath(path))
+    return files
+
+
+class FileCheckerThread(threading.Thread):
+    """ 一旦发现一个模块文件发生了变化，或者lockfile被删除/太久没有更新，就中断主线程 """
+
+    def __init__(self, lockfile, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lockfile, self.interval = lockfile, interval
+        #: 'reload', 'error', 'exit'其中之一
+        self.status = None
+
+    def _lockfile_ok(self):
+        try:
+            return os.stat(self.lockfile).st_mtime >= time.time() - self.interval - 5
+        except OSError:
+            return False
+
+    def run(self):
+        exists = os.path.exists
+        mtime = lambda p: os.stat(p).st_mtime
+        files = dict((path, mtime(path)) for path in _module_files())
+
+        while not self.status:
+            if not self._lockfile_ok():
+                self.status = 'error'
+                thread.interrupt_main()
+            for path, lmtime in list(files.items()):
+                if not exists(path) or mtime(path) > lmtime:
+                    self.status = 'reload'
+                    thread.interrupt_main()
+                    break
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start()
+
+    def __exit__(self, exc_type, *_):
+        if not self.status: self.status = 'exit'  # 静默退出
+        self.join()
+        return exc_type is not None and issubclass(exc_type, KeyboardInterrupt)
+
+
+class InotifyCheckerThread(FileCheckerThread):
+    """ 和FileCheckerThread一样，但是通过Linux的inotify(ctypes)等待文件变化，不需要轮询mtime
+
+    只监视已经import的模块所在的目录，并且只关心这些模块的文件名(编辑器经常先写一个
+    临时文件再rename, 所以监视目录比监视文件本身更可靠)．一连串的变化(比如保存多个文件,
+    git checkout)在安静`debounce`秒之后才触发一次重载．
+    不能使用inotify时，构造函数会抛出OSError.
+    """
+
+    IN_MODIFY, IN_CLOSE_WRITE = 0x2, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    #: 最后一个事件之后要安静多久才重载(秒)
+    debounce = 0.2
+
+    def __init__(self, lockfile, interval):
+        FileCheckerThread.__init__(self, lockfile, interval)
+        import ctypes, ctypes.util
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux.")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("libc has no inotify support.")
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed.")
+        self.watches = {}   # watch描述符 -> (目录, 这个目录中需要关心的文件名)
+        dirs = {}
+        for path in _module_files():
+            dirs.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+        for dirname, names in dirs.items():
+            wd = libc.inotify_add_watch(self.fd, tob(dirname, sys.getfilesystemencoding()), self.MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed: %s" % dirname)
+            self.watches[wd] = (dirname, set(tob(n, sys.getfilesystemencoding()) for n in names))
+
+    def _changed(self):
+        """ 读取所有待处理的事件，返回是否有被监视的模块文件发生了变化 """
+        import struct
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:     # EAGAIN: 没有更多的事件
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, size = struct.unpack_from('iIII', data, offset)
+                name = data[offset + 16:offset + 16 + size].rstrip(b'\0')
+                offset += 16 + size
+                if wd in self.watches and name in self.watches[wd][1]:
+                    changed = True
+
+    def run(self):
+        import select
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        # 两个截止时间: 最后一个相关事件之后debounce秒重载，每interval秒检查一次lockfile.
+        # 同一个目录里其它文件(比如日志)的事件只被读掉，不会推迟这两个时间
+        reload_at, check_at = None, _timer() + self.interval
+        try:
+            while not self.status:
+                now = _timer()
+                if reload_at is not None and now >= reload_at:
+                    self.status = 'reload'
+                    thread.interrupt_main()
+                    break
+                if now >= check_at:
+                    check_at = now + self.interval
+                    if not self._lockfile_ok():
+                        self.status = 'error'
+                        thread.interrupt_main()
+                        break
+                wake = check_at if reload_at is None else min(check_at, reload_at)
+                if poller.poll(max(0.0, wake - now) * 1000) and self._changed():
+                    reload_at = _timer() + self.debounce
+        finally:
+            os.close(self.fd)
+
+
+def _file_checker(lockfile, interval):
+    """ 返回--reload使用的文件检查线程: 优先使用inotify，不可用时回退到轮询mtime """
+    try:
+        return InotifyCheckerThread(lockfile, interval)
+    except OSError:
+        return FileCheckerThread(lockfile, interval)
+
+
+def load(target, **namespace):
+    """ 按'package.module:target'的形式import一个模块或者模块中的对象
+
+        target可以是一个表达式，比如'package.module:make_app(debug=True)'，
+        namespace中的关键字参数作为这个表达式的局部变量 """
+    module, target = target.split(":", 1) if ':' in target else (target, None)
+    if module not in sys.modules: __import__(module)
+    if not target: return sys.modules[module]
+    if target.isalnum(): return getattr(sys.modules[module], target)
+    package_name = module.split('.')[0]
+    namespace[package_name] = sys.modules[package_name]
+    return eval('%s.%s' % (module, target), namespace)
+
+
+def run(app, server='wsgiref', host='127.0.0.1', port=8080, interval=1, reloader=False,
+        quiet=False, plugins=None, debug=None, config=None, **kargs):
+    """ 用一个服务器适配器运行WSGI应用，直到按下Ctrl-C
+
+    参数:
+        app: WSGI应用，或者load()能够载入的'package.module:app'．
+        server: server_names中的名称，ServerAdapter的子类或者实例．
+        interval: reloader检查lockfile(轮询时还有模块文件)的间隔(秒)．
+        reloader: 在一个子进程中运行服务器，模块文件变化时重新启动它．
+        plugins: 用app.install()安装的插件(或者load()能够载入的名称)．
+        config: 一个ConfigDict．应用已经有ConfigDict类型的app.config时，逐层合并进去
+                (会触发它的回调)，否则设置为app.config．
+        kargs: 其它关键字参数传给服务器适配器(比如PreforkServer的workers)．
+    """
+    if reloader and not os.environ.get('BOTTLE_CHILD'):
+        # 父进程: 不断重新启动子进程，子进程以返回码3退出表示需要重载．
+        # 父进程定期更新lockfile, 子进程发现它消失或者太久没有更新就退出
+        import subprocess
+        fd, lockfile = tempfile.mkstemp(prefix='bottle.', suffix='.lock')
+        environ = os.environ.copy()
+        environ['BOTTLE_CHILD'] = 'true'
+        environ['BOTTLE_LOCKFILE'] = lockfile
+        args = [sys.executable] + sys.argv
+        if getattr(sys.modules.get('__main__'), '__package__', None):
+            args[1:1] = ['-m', sys.modules['__main__'].__package__]    # 用`python -m`启动的
+        try:
+            os.close(fd)
+            while os.path.exists(lockfile):
+                p = subprocess.Popen(args, env=environ)
+                while p.poll() is None:
+                    os.utime(lockfile, None)
+                    time.sleep(interval)
+                if p.returncode == 3:
+                    continue
+                sys.exit(p.returncode)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(lockfile):
+                os.unlink(lockfile)
+        return
+
+    try:
+        if debug is not None:
+            global DEBUG
+            DEBUG = bool(debug)
+        if isinstance(app, basestring):
+            app = load(app)
+        if not callable(app):
+            raise ValueError("Application is not callable: %r" % app)
+
+        if config is not None:
+            if isinstance(getattr(app, 'config', None), ConfigDict):
+                app.config._files.extend(config._files)    # reload()也重新读取这些文件
+                for layer in config.layers:
+                    app.config.update_layer(layer, config.layer(layer))
+            else:
+                app.config = config
+
+        for plugin in plugins or ():
+            if isinstance(plugin, basestring):
+                plugin = load(plugin)
+            if not hasattr(app, 'install'):
+                raise ValueError("Application %r has no install() for plugin %r" % (app, plugin))
+            app.install(plugin)
+
+        if server in server_names:
+            server = server_names.get(server)
+        if isinstance(server, basestring):
+            server = load(server)
+        if isinstance(server, type):
+            server = server(host=host, port=port, **kargs)
+        if not isinstance(server, ServerAdapter):
+            raise ValueError("Unknown or unsupported server: %r" % server)
+
+        server.quiet = server.quiet or quiet
+        if not server.quiet:
+            _stderr("Bottle v%s server starting up (using %r)...\n" % (__version__, server))
+            _stderr("Listening on http://%s:%d/\n" % (server.host, server.port))
+            _stderr("Hit Ctrl-C to quit.\n\n")
+
+        if reloader:
+            # 应用已经载入，它import的模块文件都会被监视
+            bgcheck = _file_checker(os.environ.get('BOTTLE_LOCKFILE'), interval)
+            with bgcheck:
+                server.run(app)
+            if bgcheck.status == 'reload':
+                sys.exit(3)
+        else:
+            server.run(app)
+    except KeyboardInterrupt:
+        pass
+    except (SystemExit, MemoryError):
+        raise
+    except:
+        if not reloader: raise
+        # 子进程: 应用载入失败(比如语法错误)时等一会儿再重试，而不是结束父进程
+        print_exc()
+        time.sleep(interval)
+        sys.exit(3)
+
+
+###############################################################################
+# 插件 #########################################################################
+###############################################################################
+# 通常每个插件用apply()把回调函数包装一层，装了六个插件，每个请求就要穿过六层闭包．
+# compile_plugins()在路由第一次被请求时把插件链编译成一个callable:
+#
+#   * 只在调用前后做点事情的插件可以不实现apply(), 而是实现before(route)和
+#     after(route, rv)两个钩子(hook). 相邻的钩子插件被合并(fuse)成一层.
+#   * 其它插件照常通过apply()包装.
+#   * 如果给出一个PluginProfiler, 每一层都会被计时，报告每个插件给这个路由增加的时间.
+
+
+class PluginProfiler(object):
+    """ 记录每个路由中每个插件层的耗时 """
+
+    def __init__(self):
+        self.layers = {}    # 路由 -> 从外到内的[层名称, 调用次数, 累计时间(包含内层)]
+
+    def _layer(self, route, name):
+        layers = self.layers.setdefault(route, [])
+        entry = [name, 0, 0.0]
+        layers.insert(0, entry)     # 从内向外编译，所以新的一层在最外面
+        return entry
+
+    def timed(self, func, route, name):
+        entry = self._layer(route, name)
+
+        def wrapper(*a, **ka):
+            start = _timer()
+            try:
+                return func(*a, **ka)
+            finally:
+                entry[1] += 1
+                entry[2] += _timer() - start
+        return wrapper
+
+    def report(self):
+        """ 返回{路由: [(插件名称, 调用次数, 平均每次调用增加的秒数)]}
+
+        每个插件的时间是它这一层的总时间减去内层的总时间．
+        """
+        report = {}
+        for route, layers in self.layers.items():
+            rows = []
+            for i, (name, calls, total) in enumerate(layers):
+                inner = layers[i + 1][2] if i + 1 < len(layers) else 0.0
+                rows.append((name, calls, (total - inner) / calls if calls else 0.0))
+            report[route] = rows
+        return report
+
+
+def _fuse_hooks(callback, hooks, route):
+    """ 把一组钩子插件合并成回调函数外面的一层 """
+    befores = [functools.partial(p.before, route) for p in hooks if hasattr(p, 'before')]
+    afters = [functools.partial(p.after, route) for p in reversed(hooks) if hasattr(p, 'after')]
+
+    def fused(*a, **ka):
+        for before in befores:
+            before()
+        rv = callback(*a, **ka)
+        for after in afters:
+            rv = after(rv)
+        return rv
+    return fused
+
+
+def compile_plugins(callback, plugins, route=None, profiler=None):
+    """ 把plugins(从外到内)应用到callback上，返回一个callable
+
+    插件抛出RouteReset时，整个插件链会重新编译．
+    """
+    name = lambda p: getattr(p, 'name', None) or getattr(p, '__name__', None) or repr(p)
+    key = getattr(route, 'rule', None) or route or getattr(callback, '__name__', repr(callback))
+    if profiler is not None:
+        profiler.layers.pop(key, None)
+
+    call, hooks = callback, []
+    if profiler is not None:
+        call = profiler.timed(call, key, 'callback')
+    try:
+        for plugin in reversed(plugins):
+            if not hasattr(plugin, 'apply') and (hasattr(plugin, 'before') or hasattr(plugin, 'after')):
+                hooks.insert(0, plugin)
+                continue
+            if hooks:
+                call = _fuse_hooks(call, hooks, route)
+                if profiler is not None:
+                    call = profiler.timed(call, key, '+'.join(name(p) for p in hooks))
+                hooks = []
+            layer = plugin.apply(call, route) if hasattr(plugin, 'apply') else plugin(call)
+            if layer is not call:
+                update_wrapper(layer, callback)
+                if profiler is not None:
+                    layer = profiler.timed(layer, key, name(plugin))
+            call = layer
+        if hooks:
+            call = _fuse_hooks(call, hooks, route)
+            if profiler is not None:
+                call = profiler.timed(call, key, '+'.join(name(p) for p in hooks))
+    except RouteReset:
+        return compile_plugins(callback, plugins, route, profiler)
+    return call
+
+
+###############################################################################
+# 静态文件 #####################################################################
+###############################################################################
+
+
+#: (st_dev, st_ino, st_mtime_ns, st_size) -> 强ETag
+_etag_cache = OrderedDict()
+_etag_cache_size = 4096
+_etag_lock = threading.Lock()
+
+
+def _file_etag(filename, stats):
+    """ 强ETag只由文件的元数据决定(和upstream一样)，不读取文件内容:
+        几个GB的下载在第一次请求时也不需要经过Python的缓冲区 """
+    key = (stats.st_dev, stats.st_ino, getattr(stats, 'st_mtime_ns', stats.st_mtime), stats.st_size)
+    with _etag_lock:
+        etag = _etag_cache.get(key)
+    if etag is None:
+        etag = '"%s"' % hashlib.sha1(tob('%d:%d:%d:%d' % key)).hexdigest()
+        with _etag_lock:
+            _etag_cache[key] = etag
+            while len(_etag_cache) > _etag_cache_size:
+                _etag_cache.popitem(last=False)
+    return etag
+
+
+def parse_date(ims):
+    """ 把rfc1123, rfc850或者asctime格式的时间解析为时间戳 """
+    try:
+        ts = email.utils.parsedate_tz(ims)
+        return email.utils.mktime_tz(ts)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def http_date(value):
+    return email.utils.formatdate(value, usegmt=True)
+
+
+def parse_range_header(header, maxlen=0):
+    """ 解析一个Range头，yield (start, end)元组(end不包含在内)．无效的区间被忽略 """
+    if not header or header[:6] != 'bytes=': return
+    ranges = [r.split('-', 1) for r in header[6:].split(',') if '-' in r]
+    for start, end in ranges:
+        try:
+            if not start:   # bytes=-100    -> 最后100个字节
+                start, end = max(0, maxlen - int(end)), maxlen
+            elif not end:   # bytes=100-    -> 从第100个字节开始的所有内容
+                start, end = int(start), maxlen
+            else:           # bytes=100-200 -> 第100到200个字节(包含)
+                start, end = int(start), min(int(end) + 1, maxlen)
+            if 0 <= start < end <= maxlen:
+                yield start, end
+        except ValueError:
+            pass
+
+
+_range_spec = re.compile(r'^\s*(?:(\d+)-(\d*)|-\d+)\s*$')
+
+
+def _range_header_valid(header):
+    """ Range头的语法是否正确(RFC 7233 2.1节)．语法错误的Range头要被忽略，
+        只有语法正确、但是没有一个区间可以满足时才返回416 """
+    specs = [spec for spec in header[6:].split(',') if spec.strip()]  # 列表中允许有空元素
+    if header[:6] != 'bytes=' or not specs:
+        return False
+    for spec in specs:
+        match = _range_spec.match(spec)
+        if not match:
+            return False
+        first, last = match.groups()
+        if last and int(last) < int(first):
+            return False
+    return True
+
+
+#: 一个请求最多可以有多少个(合并之后的)区间，更多时发送整个文件
+max_ranges = 16
+
+
+def _merge_ranges(ranges):
+    """ 排序并合并重叠或相邻的区间 """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def _etag_matches(header, etag):
+    """ If-None-Match使用弱比较，'*'匹配任何ETag """
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in [t[2:] if t[:2] == 'W/' else t for t in tags]
+
+
+class _FileRange(object):
+    """ 文件的一个区间．有fileno()和tell(), 支持sendfile的服务器可以零拷贝地发送它,
+    其它服务器通过read()读取，不会超出区间的末尾．
+    """
+
+    def __init__(self, fp, start, end):
+        self.fp, self.remaining = fp, end - start
+        fp.seek(start)
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def tell(self):
+        return self.fp.tell()
+
+    def seek(self, offset):
+        self.fp.seek(offset)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(2 ** 16), b'')
+
+    def close(self):
+        self.fp.close()
+
+
+def _iter_ranges(fp, ranges, boundary, header, size, bufsize=2 ** 16):
+    """ multipart/byteranges响应体 """
+    try:
+        for start, end in ranges:
+            yield tob('--%s\r\n%sContent-Range: bytes %d-%d/%d\r\n\r\n'
+                      % (boundary, header, start, end - 1, size))
+            part = _FileRange(fp, start, end)
+            for block in iter(lambda: part.read(bufsize), b''):
+                yield block
+            yield b'\r\n'
+        yield tob('--%s--\r\n' % boundary)
+    finally:
+        fp.close()
+
+
+def send_static_file(environ, start_response, filename, root,
+                     mimetype=True, download=False, charset='UTF-8', precompressed=True):
+    """ 发送root目录中的一个文件，返回WSGI响应体
+
+    * 响应体尽可能交给environ['wsgi.file_wrapper'], 支持的服务器会用sendfile零拷贝发送
+    * 强ETag由(设备, inode, mtime, 大小)得出，不读取文件内容．If-None-Match和
+      If-Modified-Since命中时返回304
+    * 支持Range(包括多个区间的multipart/byteranges)和If-Range. 重叠或相邻的区间被合并,
+      合并后超过max_ranges个区间或者请求的总长度超过文件大小时发送整个文件
+    * 如果precompressed为True并且客户端接受，优先发送预先压缩好的`.br`/`.gz`文件
+    """
+    def error(status, text, headers=()):
+        start_response(status, [('Content-Type', 'text/plain'),
+                                ('Content-Length', str(len(text)))] + list(headers))
+        return [tob(text)]
+
+    root = os.path.join(os.path.abspath(root), '')
+    filename = os.path.abspath(os.path.join(root, filename.strip('/\\')))
+    if not filename.startswith(root):
+        return error('403 Forbidden', 'Access denied.')
+    if not os.path.exists(filename) or not os.path.isfile(filename):
+        return error('404 Not Found', 'File does not exist.')
+    if not os.access(filename, os.R_OK):
+        return error('403 Forbidden', 'You do not have permission to access this file.')
+
+    headers = []
+    if mimetype is True:
+        mimetype, encoding = mimetypes.guess_type(filename)
+        if encoding: headers.append(('Content-Encoding', encoding))
+    if mimetype:
+        if mimetype[:5] == 'text/' and charset and 'charset' not in mimetype:
+            mimetype += '; charset=%s' % charset
+        headers.append(('Content-Type', mimetype))
+    if download:
+        download = os.path.basename(filename if download is True else download)
+        headers.append(('Content-Disposition', 'attachment; filename="%s"' % download))
+    if precompressed and not any(h[0] == 'Content-Encoding' for h in headers):
+        siblings = [(c, filename + x) for c, x in (('br', '.br'), ('gzip', '.gz'))
+                    if os.path.isfile(filename + x)]
+        if siblings:
+            headers.append(('Vary', 'Accept-Encoding'))
+            accepted = _accept_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+            for coding, sibling in siblings:
+                if accepted.get(coding, 0) > 0:
+                    filename = sibling
+                    headers.append(('Content-Encoding', coding))
+                    break
+
+    stats = os.stat(filename)
+    size, mtime = stats.st_size, int(stats.st_mtime)
+    etag = _file_etag(filename, stats)
+    headers += [('Last-Modified', http_date(mtime)), ('ETag', etag), ('Accept-Ranges', 'bytes')]
+
+    inm = environ.get('HTTP_IF_NONE_MATCH')
+    ims = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if inm is not None:
+        not_modified = _etag_matches(inm, etag)
+    else:
+        ims = ims and parse_date(ims.split(';')[0].strip())
+        not_modified = ims is not None and ims >= mtime
+    if not_modified:
+        start_response('304 Not Modified', headers)
+        return []
+
+    method = environ.get('REQUEST_METHOD', 'GET')
+    range_header = environ.get('HTTP_RANGE')
+    if_range = environ.get('HTTP_IF_RANGE')
+    if range_header and if_range and if_range != etag and parse_date(if_range) != mtime:
+        range_header = None     # 文件已经变化，发送整个文件
+    if range_header and not _range_header_valid(range_header):
+        range_header = None
+    ranges = list(parse_range_header(range_header, size)) if range_header else None
+
+    if ranges == []:
+        return error('416 Requested Range Not Satisfiable', 'Requested Range Not Satisfiable',
+                     [('Content-Range', 'bytes */%d' % size)])
+    if ranges and len(ranges) > 1:
+        # 很多重叠的小区间可以让一个很短的请求得到成倍于文件大小的响应
+        requested = sum(end - start for start, end in ranges)
+        ranges = _merge_ranges(ranges)
+        if len(ranges) > max_ranges or requested > size:
+            ranges = None
+
+    if method == 'HEAD':
+        headers.append(('Content-Length', str(size)))
+        start_response('200 OK', headers)
+        return []
+
+    fp = open(filename, 'rb')
+    wrapper = environ.get('wsgi.file_wrapper')
+    if ranges is None:
+        headers.append(('Content-Length', str(size)))
+        start_response('200 OK', headers)
+        return wrapper(fp, 2 ** 16) if wrapper else _FileRange(fp, 0, size)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers += [('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, size)),
+                    ('Content-Length', str(end - start))]
+        start_response('206 Partial Content', headers)
+        body = _FileRange(fp, start, end)
+        return wrapper(body, 2 ** 16) if wrapper else body
+
+    boundary = hashlib.sha1(tob('%s%s' % (etag, time.time()))).hexdigest()
+    part_header = ''.join('%s: %s\r\n' % h for h in headers if h[0] == 'Content-Type')
+    length = sum(len(tob('--%s\r\n%sContent-Range: bytes %d-%d/%d\r\n\r\n'
+                         % (boundary, part_header, s, e - 1, size))) + e - s + 2
+                 for s, e in ranges) + len(boundary) + 6
+    headers = [h for h in headers if h[0] != 'Content-Type']
+    headers += [('Content-Type', 'multipart/byteranges; boundary=%s' % boundary),
+                ('Content-Length', str(length))]
+    start_response('206 Partial Content', headers)
+    return _iter_ranges(fp, ranges, boundary, part_header, size)
+
+
+###############################################################################
+# 压缩 #########################################################################
+###############################################################################
+
+
+def _accept_encodings(header):
+    """ 把Accept-Encoding头解析为{编码: q值} """
+    result = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding: continue
+        q = 1.0
+        params = params.strip()
+        if params[:2] == 'q=':
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[coding] = q
+    return result
+
+
+class _GzipEncoder(object):
+    name = 'gzip'
+
+    def __init__(self, level):
+        import zlib
+        self._zlib = zlib
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, flush=False):
+        out = self._c.compress(data)
+        return out + self._c.flush(self._zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self):
+        return self._c.flush()
+
+
+class _BrotliEncoder(object):
+    name = 'br'
+
+    def __init__(self, level):
+        import brotli
+        self._c = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data, flush=False):
+        out = self._c.process(data)
+        return out + self._c.flush() if flush else out
+
+    def finish(self):
+        return self._c.finish()
+
+
+_thread_time = getattr(time, 'thread_time', _timer)
+
+
+class CompressionMiddleware(object):
+    """ 响应的压缩阶段(WSGI中间件)，根据Accept-Encoding选择br(需要brotli包)或者gzip
+
+    * 响应体是流式的可迭代对象时逐块压缩，不会先把整个响应体读进内存．
+      对于不是list/tuple的响应体，每一块都会flush, 保证流式的数据及时到达客户端．
+    * 小于min_size字节的响应不压缩．没有Content-Length时，先缓冲最多min_size个字节再决定．
+    * 已经有Content-Encoding的响应(比如send_static_file发送的`.gz`/`.br`文件)、
+      206/304等响应以及不可压缩的Content-Type会原样通过．
+    * 每个响应花在压缩上的CPU时间(秒)记录在environ['bottle.compress.time'],
+      累计的统计数据在self.stats中．
+    """
+
+    compressible = ('text/', 'application/json', 'application/javascript',
+                    'application/xml', 'image/svg+xml')
+
+    def __init__(self, app, min_size=1024, level=6, encodings=('br', 'gzip')):
+        self.app, self.min_size, self.level = app, min_size, level
+        self.encoders = {'gzip': _GzipEncoder}
+        if 'br' in encodings:
+            try:    # 只有需要br时才import brotli，不拖慢import bottle
+                import brotli
+                self.encoders['br'] = _BrotliEncoder
+            except ImportError:
+                pass
+        self.encodings = [e for e in encodings if e in self.encoders]
+        self.stats = {'responses': 0, 'compressed': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_time': 0.0}
+        self._lock = threading.Lock()
+
+    def _choose(self, environ):
+        accepted = _accept_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        best, best_q = None, 0.0
+        for coding in self.encodings:
+            q = accepted.get(coding, accepted.get('*', 0.0))
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+    def _should_compress(self, status, headers):
+        if status[:3] in ('204', '206', '304') or status[:1] == '1':
+            return False
+        names = dict((k.lower(), v) for k, v in headers)
+        if 'content-encoding' in names:
+            return False
+        ctype = names.get('content-type', '').split(';')[0].strip().lower()
+        if not ctype.startswith(self.compressible):
+            return False
+        length = names.get('content-length')
+        return not (length and length.isdigit() and int(length) < self.min_size)
+
+    def __call__(self, environ, start_response):
+        coding = self._choose(environ) if environ.get('REQUEST_METHOD') != 'HEAD' else None
+        if coding is None:
+            return self.app(environ, start_response)
+
+        state = {}
+
+        def capture(status, headers, exc_info=None):
+            if exc_info and state.get('sent'):
+                _raise(*exc_info)
+            state['status'], state['headers'] = status, list(headers)
+            return lambda data: state.setdefault('written', []).append(data)
+
+        result = self.app(environ, capture)
+        return self._iter(environ, start_response, result, coding, state)
+
+    def _iter(self, environ, start_response, result, coding, state):
+        stream = not isinstance(result, (list, tuple))
+        try:
+            chunks = iter(result)
+            buffered, size = [], 0
+            for chunk in chunks:
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            else:
+                chunks = None   # 响应体已经全部读完
+            buffered = state.pop('written', []) + buffered
+
+            status, headers = state['status'], state['headers']
+            too_small = chunks is None and size < self.min_size
+            if too_small or not self._should_compress(status, headers):
+                start_response(status, headers)
+                state['sent'] = True
+                for chunk in buffered:
+                    yield chunk
+                for chunk in chunks or ():
+                    yield chunk
+                return
+
+            headers = [(k, v) for k, v in headers if k.lower() != 'content-length']
+            for i, (k, v) in enumerate(headers):
+                if k.lower() == 'etag' and v.endswith('"'):
+                    headers[i] = (k, v[:-1] + '-' + coding + '"')
+            headers += [('Content-Encoding', coding), ('Vary', 'Accept-Encoding')]
+            start_response(status, headers)
+            state['sent'] = True
+
+            encoder = self.encoders[coding](self.level)
+            cpu, size_in, size_out = 0.0, 0, 0
+            for chunk in itertools.chain(buffered, chunks or ()):
+                start = _thread_time()
+                out = encoder.compress(chunk, flush=stream)
+                cpu += _thread_time() - start
+                size_in, size_out = size_in + len(chunk), size_out + len(out)
+                if out:
+                    yield out
+            start = _thread_time()
+            out = encoder.finish()
+            cpu += _thread_time() - start
+            size_out += len(out)
+            environ['bottle.compress.time'] = cpu
+            with self._lock:
+                self.stats['compressed'] += 1
+                self.stats['bytes_in'] += size_in
+                self.stats['bytes_out'] += size_out
+                self.stats['cpu_time'] += cpu
+            if out:
+                yield out
+        finally:
+            with self._lock:
+                self.stats['responses'] += 1
+            if hasattr(result, 'close'):
+                result.close()
+
+
+###############################################################################
+# 请求统计 #####################################################################
+###############################################################################
+# 不依赖外部的APM找出慢的路由．RequestStats是一个WSGI中间件，为每个路由记录四个
+# 延迟直方图: total(整个请求，包括迭代响应体)，plugins(花在插件层里的时间),
+# callback(回调函数本身)和serialize(JSONPlugin的序列化时间)．
+
+
+class LatencyHistogram(object):
+    """ HDR风格的延迟直方图，单位是微秒
+
+    小于2**sub_bits的值每个值一个桶．更大的值按2的幂分段，每段再等分成
+    2**(sub_bits-1)个桶，所以记录的值的相对误差小于2**(1-sub_bits)
+    (sub_bits=7时小于1.6%)．桶保存在稀疏的dict里，记录一个值是O(1),
+    只有计算百分位数时才需要排序．
+    """
+
+    def __init__(self, sub_bits=7):
+        self.sub_bits = sub_bits
+        self.counts = {}
+        self.count = self.sum = self.max = 0
+        self.min = None
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return (shift << (self.sub_bits - 1)) + (value >> shift)
+
+    def _highest(self, index):
+        """ 和index这个桶等价的最大值 """
+        if index < 1 << self.sub_bits:
+            return index
+        shift = (index >> (self.sub_bits - 1)) - 1
+        return ((index - (shift << (self.sub_bits - 1)) + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = int(seconds * 1e6)
+        index = self._index(value)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+            if self.min is None or value < self.min:
+                self.min = value
+
+    def percentile(self, p):
+        with self._lock:
+            counts, count, highest = sorted(self.counts.items()), self.count, self.max
+        rank, seen = p / 100.0 * count, 0
+        for index, n in counts:
+            seen += n
+            if seen >= rank:
+                return min(self._highest(index), highest)
+        return 0
+
+    def summary(self, points=(50, 90, 99, 99.9)):
+        """ 返回{count, min, max, mean, p50, ...}，单位是微秒 """
+        result = {'count': self.count, 'min': self.min or 0, 'max': self.max,
+                  'mean': round(self.sum / float(self.count), 1) if self.count else 0}
+        for p in points:
+            result['p%s' % p] = self.percentile(p)
+        return result
+
+
+class _StatsBody(object):
+    """ 包装流式的响应体，在服务器调用close()时结束这个请求的计时 """
+
+    def __init__(self, result, finish):
+        self.result, self.finish = result, finish
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            finish, self.finish = self.finish, None
+            if finish is not None:
+                finish()
+
+
+class RequestStats(object):
+    """ 按路由统计请求延迟的WSGI中间件
+
+        stats = RequestStats(app, endpoint='/__stats')
+
+    用stats.compile(callback, plugins, route)代替compile_plugins()编译路由,
+    才能区分插件和回调函数的时间，也才知道请求属于哪个路由；其它的请求都记在
+    '<unrouted>'下，只有total和serialize．
+
+    钩子用stats.hook(name)注册: 'before_request'接收environ, 'after_request'接收
+    environ和这个请求的计时dict(秒，同时也放在environ['bottle.stats'])．
+    endpoint不是None时，请求这个路径返回JSON格式的统计数据．
+    """
+
+    metrics = ('total', 'plugins', 'callback', 'serialize')
+    hook_names = ('before_request', 'after_request')
+
+    def __init__(self, app, endpoint=None, sub_bits=7):
+        self.app, self.endpoint, self.sub_bits = app, endpoint, sub_bits
+        self.routes = {}    # 路由 -> {metric: LatencyHistogram}
+        self._hooks = dict((name, []) for name in self.hook_names)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def add_hook(self, name, func):
+        if name not in self._hooks:
+            raise ValueError('Unknown hook %r (use one of %s)' % (name, ', '.join(self.hook_names)))
+        self._hooks[name].append(func)
+
+    def hook(self, name):
+        """ 以装饰器的方式注册钩子 """
+        def decorator(func):
+            self.add_hook(name, func)
+            return func
+        return decorator
+
+    def compile(self, callback, plugins, route=None, profiler=None):
+        """ 和compile_plugins()一样，另外记录回调函数和整个插件链的时间 """
+        local = self._local
+        key = ('%s %s' % (getattr(route, 'method', 'ANY'), route.rule)
+               if hasattr(route, 'rule') else getattr(callback, '__name__', repr(callback)))
+
+        def timed_callback(*a, **ka):
+            start = _timer()
+            try:
+                return callback(*a, **ka)
+            finally:
+                timings = getattr(local, 'timings', None)
+                if timings is not None:
+                    timings['callback'] = timings.get('callback', 0.0) + _timer() - start
+
+        call = compile_plugins(timed_callback, plugins, route, profiler)
+
+        def timed_route(*a, **ka):
+            timings = getattr(local, 'timings', None)
+            start = _timer()
+            try:
+                return call(*a, **ka)
+            finally:
+                if timings is not None:
+                    timings['route'] = key
+                    timings['_app'] = _timer() - start
+                    timings['_json'] = local.environ.get('bottle.json.time', 0.0)
+        return timed_route
+
+    def __call__(self, environ, start_response):
+        if self.endpoint is not None and environ.get('PATH_INFO') == self.endpoint:
+            return self._serve(environ, start_response)
+
+        for hook in self._hooks['before_request']:
+            hook(environ)
+        timings = environ['bottle.stats'] = {'route': None}
+        local, start = self._local, _timer()
+        finish = lambda: self._finish(environ, timings, start)
+        local.timings, local.environ = timings, environ
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            finish()
+            raise
+        finally:
+            local.timings = local.environ = None
+
+        # list和wsgi.file_wrapper(可能会用sendfile)原样交给服务器
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(result, (list, tuple)) or \
+                (isinstance(file_wrapper, type) and isinstance(result, file_wrapper)):
+            finish()
+            return result
+        return _StatsBody(result, finish)
+
+    def _finish(self, environ, timings, start):
+        timings['total'] = _timer() - start
+        timings['serialize'] = environ.get('bottle.json.time', 0.0)
+        if '_app' in timings:
+            app, json_time = timings.pop('_app'), timings.pop('_json')
+            timings.setdefault('callback', 0.0)
+            timings['plugins'] = max(0.0, app - timings['callback'] - json_time)
+
+        histograms = self.routes.get(timings['route'] or '<unrouted>')
+        if histograms is None:
+            with self._lock:
+                histograms = self.routes.setdefault(
+                    timings['route'] or '<unrouted>',
+                    dict((m, LatencyHistogram(self.sub_bits)) for m in self.metrics))
+        for metric in self.metrics:
+            if metric in timings:
+                histograms[metric].record(timings[metric])
+
+        for hook in self._hooks['after_request']:
+            hook(environ, timings)
+
+    def report(self):
+        """ 返回{路由: {metric: 直方图摘要(微秒)}}，没有数据的metric被省略 """
+        with self._lock:
+            routes = list(self.routes.items())
+        return dict((route, dict((m, h.summary()) for m, h in histograms.items() if h.count))
+                    for route, histograms in routes)
+
+    def _serve(self, environ, start_response):
+        body = get_json_codec().encode(self.report())
+        start_response('200 OK', [('Content-Type', 'application/json'),
+                                  ('Content-Length', str(len(body))),
+                                  ('Cache-Control', 'no-store')])
+        return [body]
+
+
+###############################################################################
+# 模版 #########################################################################
+###############################################################################
+
+
+class TemplateCodeCache(object):
+    """ 把编译好的模版代码对象(code object)用marshal持久化到磁盘
+
+    模版适配器通常在进程启动时重新翻译、编译所有模版．有了这个缓存，冷启动时
+    只需要用marshal读取代码对象．缓存文件以模版名称和源码的哈希命名，源码改变后
+    哈希随之改变，旧的缓存文件会被删除．文件头包含Python的magic number,
+    不同版本的解释器不会读到彼此的缓存．
+    """
+
+    def __init__(self, directory, prefix='bottle-tpl-'):
+        self.directory, self.prefix = directory, prefix
+        self.hits = self.misses = 0
+        from importlib.util import MAGIC_NUMBER
+        self.magic = MAGIC_NUMBER
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _paths(self, name, source):
+        name_key = hashlib.sha1(tob(name)).hexdigest()[:16]
+        source_key = hashlib.sha1(tob(source)).hexdigest()
+        base = os.path.join(self.directory, '%s%s-' % (self.prefix, name_key))
+        return base, base + source_key + '.marshal'
+
+    def load(self, name, source, compile_func):
+        """ 返回模版的代码对象．缓存没有命中时调用compile_func(source)并写入缓存 """
+        import marshal
+        base, path = self._paths(name, source)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            if data[:len(self.magic)] == self.magic:
+                code = marshal.loads(data[len(self.magic):])
+                self.hits += 1
+                return code
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            pass
+
+        self.misses += 1
+        code = compile_func(source)
+        self._invalidate(base, path)
+        # 先写入临时文件再rename, 并发的进程不会读到写了一半的缓存
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            with open(tmp, 'wb') as fp:
+                fp.write(self.magic + marshal.dumps(code))
+            os.rename(tmp, path)
+        except (IOError, OSError, ValueError):
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return code
+
+    def _invalidate(self, base, keep=None):
+        """ 删除一个模版过期的缓存文件 """
+        dirname, stem = os.path.split(base)
+        for filename in os.listdir(dirname):
+            path = os.path.join(dirname, filename)
+            if filename.startswith(stem) and filename.endswith('.marshal') and path != keep:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """ 删除所有的缓存文件 """
+        for filename in os.listdir(self.directory):
+            if filename.startswith(self.prefix) and filename.endswith('.marshal'):
+                os.unlink(os.path.join(self.directory, filename))
+
+
+###############################################################################
+# 常量和默认设置 ################################################################
+###############################################################################
+
+
+#: True打开调试模式，'strict'让depr()抛出DeprecationWarning而不是只发出警告
+DEBUG = False
+
+
+def _main(argv):  # pragma: no cover
+    args, parser = _cli_parse(argv)
+
+    def _cli_error(cli_msg):
+        parser.print_help()
+        _stderr('\nError: %s\n' % cli_msg)
+        sys.exit(1)
+
+    if args.version:
+        _stdout('Bottle %s\n' % __version__)
+        sys.exit(0)
+    if not args.app:
+        _cli_error("No application entry point specified.")
+
+    sys.path.insert(0, '.')
+    sys.modules.setdefault('bottle', sys.modules['__main__'])
+
+    # --bind HOST[:PORT]，IPv6地址写成[::1]:8080
+    host, port = (args.bind or 'localhost'), 8080
+    if ':' in host and host.rfind(']') < host.rfind(':'):
+        host, port = host.rsplit(':', 1)
+    host = host.strip('[]')
+    if not str(port).isdigit():
+        _cli_error("Invalid port in --bind: %r" % args.bind)
+
+    if args.server not in server_names and ':' not in args.server:
+        _cli_error("Unknown server %r (use one of %s, or package.module:Adapter)."
+                   % (args.server, ', '.join(sorted(server_names))))
+
+    config = ConfigDict()
+    for cfile in args.conf or []:
+        if not os.path.isfile(cfile):
+            _cli_error("Unable to read config file %r" % cfile)
+        try:
+            config.load_config(cfile)
+        except configparser.Error as parse_error:
+            _cli_error(parse_error)
+    try:
+        config.load_args(args.param)
+    except ValueError as error:
+        _cli_error(error)
+
+    options = {}
+    if args.workers is not None:
+        if args.server == 'wsgiref':
+            _cli_error("--workers needs a server with a worker pool (e.g. --server prefork).")
+        options['workers'] = args.workers
+
+    run(args.app, server=args.server, host=host, port=int(port), reloader=args.reload,
+        plugins=args.plugin, debug=args.debug, config=config, **options)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    _main(sys.argv)